@@ -0,0 +1,84 @@
+"""
+Storage for precomputed insights and suggested-question answers.
+
+Filled by the batch job in precompute.py (and write-through from the live
+endpoints), so the first dashboard open and the advertised chat questions
+are served from Mongo instead of a live LLM call. The same job stores every
+user's forecast.
+"""
+import re
+from datetime import datetime, timezone
+
+import pymongo
+
+INSIGHTS = "insights"
+ANSWER = "answer"
+FORECAST = "forecast"
+
+
+def question_key(question):
+    """Normalise a question so trivial differences in case/punctuation still match."""
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", question.lower()).split())
+
+
+class PrecomputedStore:
+    """Precomputed insights JSON and chat answers per statement."""
+    def __init__(self, database):
+        self.collection = database["precomputed_answers"]
+        self.collection.create_index(
+            [("pdf_id", pymongo.ASCENDING), ("kind", pymongo.ASCENDING), ("key", pymongo.ASCENDING)],
+            unique=True,
+        )
+        self.runs = database["job_runs"]
+
+    def insights(self, pdf_id):
+        doc = self.collection.find_one({"pdf_id": pdf_id, "kind": INSIGHTS, "key": ""}, {"payload": 1})
+        return doc["payload"] if doc else None
+
+    def answer(self, pdf_id, question):
+        doc = self.collection.find_one(
+            {"pdf_id": pdf_id, "kind": ANSWER, "key": question_key(question)}, {"payload": 1}
+        )
+        return doc["payload"] if doc else None
+
+    def forecast(self, user_id, horizon, since=None):
+        """A user's stored forecast, unless it was computed before `since`."""
+        query = {"pdf_id": None, "kind": FORECAST, "key": f"{user_id}:{horizon}"}
+        if since is not None:
+            query["computed_at"] = {"$gte": since}
+        doc = self.collection.find_one(query, {"payload": 1})
+        return doc["payload"] if doc else None
+
+    def save_insights(self, pdf_id, payload):
+        self._save(pdf_id, INSIGHTS, "", payload)
+
+    def save_answer(self, pdf_id, question, answer):
+        self._save(pdf_id, ANSWER, question_key(question), answer)
+
+    def save_forecasts(self, forecasts, horizon):
+        """Store {user_id: payload} forecasts in one bulk write."""
+        now = datetime.now(timezone.utc)
+        operations = [
+            pymongo.UpdateOne(
+                {"pdf_id": None, "kind": FORECAST, "key": f"{user_id}:{horizon}"},
+                {"$set": {"payload": payload, "computed_at": now}},
+                upsert=True,
+            )
+            for user_id, payload in forecasts.items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def _save(self, pdf_id, kind, key, payload):
+        self.collection.update_one(
+            {"pdf_id": pdf_id, "kind": kind, "key": key},
+            {"$set": {"payload": payload, "computed_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def record_run(self, job, started_at, **stats):
+        self.runs.update_one(
+            {"_id": job},
+            {"$set": {"last_started_at": started_at, "last_finished_at": datetime.now(timezone.utc), **stats}},
+            upsert=True,
+        )
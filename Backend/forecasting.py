@@ -0,0 +1,210 @@
+"""
+Local time-series forecasting over monthly rollups.
+
+Classical models only (seasonal-naive, Holt exponential smoothing, linear
+trend), vectorized with NumPy across every series in a matrix so a user's
+income, expenditure and category series, or every user at once, are fitted
+in a single pass. No LLM calls.
+
+Months no uploaded statement covers are gaps, not zero activity: they are
+filled by linear interpolation between the observed months around them
+before any model sees the series.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from rollups import month_label, month_window
+
+SEASON = 12
+DEFAULT_HORIZON = 3
+MODELS = ("seasonal_naive", "exponential_smoothing", "linear_trend")
+
+
+# ============================================================================
+# Models (each maps an (n_series, n_months) matrix to (n_series, horizon))
+# ============================================================================
+
+def seasonal_naive(Y, horizon, season=SEASON):
+    """Repeat the value from one season ago; falls back to the last value."""
+    n = Y.shape[1]
+    if n < season:
+        return np.repeat(Y[:, -1:], horizon, axis=1)
+    steps = np.arange(horizon) % season
+    return Y[:, n - season + steps]
+
+
+def exponential_smoothing(Y, horizon, alpha=0.4, beta=0.2):
+    """Holt's linear (double) exponential smoothing, all series at once."""
+    level = Y[:, 0].astype(float)
+    trend = (Y[:, 1] - Y[:, 0]) if Y.shape[1] > 1 else np.zeros_like(level)
+    for t in range(1, Y.shape[1]):
+        previous = level
+        level = alpha * Y[:, t] + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous) + (1 - beta) * trend
+    steps = np.arange(1, horizon + 1)
+    return level[:, None] + trend[:, None] * steps[None, :]
+
+
+def linear_trend(Y, horizon):
+    """Least-squares line per series, extrapolated."""
+    n = Y.shape[1]
+    if n < 2:
+        return np.repeat(Y[:, -1:], horizon, axis=1)
+    x = np.arange(n)
+    slope, intercept = np.polyfit(x, Y.T, 1)
+    future = np.arange(n, n + horizon)
+    return intercept[:, None] + slope[:, None] * future[None, :]
+
+
+MODEL_FUNCTIONS = {
+    "seasonal_naive": seasonal_naive,
+    "exponential_smoothing": exponential_smoothing,
+    "linear_trend": linear_trend,
+}
+
+
+def forecast_matrix(Y, horizon, nonnegative=True):
+    """
+    Forecast every row of `Y` with the model that did best on a short holdout
+    of that row's own history. Returns (forecasts, chosen model names).
+    """
+    Y = np.asarray(Y, dtype=float)
+    holdout = min(3, Y.shape[1] // 4)
+    if holdout:
+        train, actual = Y[:, :-holdout], Y[:, -holdout:]
+        errors = np.stack([
+            np.abs(MODEL_FUNCTIONS[name](train, holdout) - actual).mean(axis=1)
+            for name in MODELS
+        ])
+        best = errors.argmin(axis=0)
+    else:
+        best = np.full(Y.shape[0], MODELS.index("exponential_smoothing"))
+
+    candidates = np.stack([MODEL_FUNCTIONS[name](Y, horizon) for name in MODELS])
+    forecasts = np.take_along_axis(candidates, best[None, :, None], axis=0)[0]
+    if nonnegative:
+        forecasts = np.maximum(forecasts, 0.0)
+    return np.round(forecasts, 2), [MODELS[i] for i in best]
+
+
+# ============================================================================
+# Rollup series -> chart payloads
+# ============================================================================
+
+def _trim_leading_unobserved(series):
+    for index, entry in enumerate(series):
+        if entry["observed"]:
+            return series[index:]
+    return []
+
+
+def _values(series, value):
+    """`value(entry)` for observed months, NaN for months without data."""
+    return [value(entry) if entry["observed"] else np.nan for entry in series]
+
+
+def _fill_gaps(Y):
+    """Interpolate NaN months in each row linearly from the observed months around them."""
+    Y = np.array(Y, dtype=float)
+    missing = np.isnan(Y)
+    if missing.any():
+        x = np.arange(Y.shape[1])
+        for row, gaps in zip(Y, missing):
+            if gaps.any() and not gaps.all():
+                row[gaps] = np.interp(x[gaps], x[~gaps], row[~gaps])
+    return Y
+
+
+def _future_months(last_month, horizon):
+    year, number = (int(part) for part in last_month.split("-"))
+    index = year * 12 + number - 1 + horizon
+    return month_window(f"{index // 12:04d}-{index % 12 + 1:02d}", horizon)
+
+
+def _chart(months, values):
+    return {"data": [{"name": month_label(m), "amount": float(v)} for m, v in zip(months, values)]}
+
+
+def _payload(series, income, expenditure, categories, category_forecasts, models):
+    months = _future_months(series[-1]["month"], len(income))
+    category_totals = category_forecasts.sum(axis=1) if len(categories) else []
+    return {
+        "charts": {
+            "incomeForecast": _chart(months, income),
+            "expenditureForecast": _chart(months, expenditure),
+            "savingsForecast": _chart(months, np.round(income - expenditure, 2)),
+            "categoryForecast": {"data": sorted(
+                ({"name": name, "amount": float(round(total, 2))} for name, total in zip(categories, category_totals)),
+                key=lambda item: item["amount"],
+                reverse=True,
+            )},
+        },
+        "models": models,
+    }
+
+
+def forecast_user(series, horizon=DEFAULT_HORIZON):
+    """
+    Forecast one user's monthly series (as returned by
+    UserRollupStore.monthly_series) `horizon` months ahead. Category amounts
+    are the forecast total over the horizon. Returns None if there is no history.
+    """
+    series = _trim_leading_unobserved(series)
+    if not series:
+        return None
+    categories = sorted({name for entry in series for name in entry["categories"]})
+    Y = _fill_gaps([_values(series, lambda e: e["income"]), _values(series, lambda e: e["expenditure"])])
+    (income, expenditure), models = forecast_matrix(Y, horizon)
+
+    category_forecasts = np.zeros((0, horizon))
+    if categories:
+        C = _fill_gaps([_values(series, lambda e, name=name: e["categories"].get(name, 0.0)) for name in categories])
+        category_forecasts, _ = forecast_matrix(C, horizon)
+    return _payload(
+        series, income, expenditure, categories, category_forecasts,
+        {"income": models[0], "expenditure": models[1]},
+    )
+
+
+def forecast_users(series_by_user, horizon=DEFAULT_HORIZON):
+    """
+    Batch variant of `forecast_user` for many users. Users with the same
+    history length are stacked into one matrix and fitted together.
+    """
+    groups = defaultdict(list)
+    for user_id, series in series_by_user.items():
+        series = _trim_leading_unobserved(series)
+        if series:
+            groups[len(series)].append((user_id, series))
+
+    results = {}
+    for members in groups.values():
+        Y = _fill_gaps([
+            row
+            for _, series in members
+            for row in (_values(series, lambda e: e["income"]), _values(series, lambda e: e["expenditure"]))
+        ])
+        forecasts, models = forecast_matrix(Y, horizon)
+
+        # All users' category series in one matrix as well.
+        category_names = [sorted({name for e in series for name in e["categories"]}) for _, series in members]
+        category_rows = [
+            _values(series, lambda e, name=name: e["categories"].get(name, 0.0))
+            for (_, series), names in zip(members, category_names)
+            for name in names
+        ]
+        category_forecasts = np.zeros((0, horizon))
+        if category_rows:
+            category_forecasts, _ = forecast_matrix(_fill_gaps(category_rows), horizon)
+
+        offset = 0
+        for position, (user_id, series) in enumerate(members):
+            names = category_names[position]
+            results[user_id] = _payload(
+                series, forecasts[2 * position], forecasts[2 * position + 1],
+                names, category_forecasts[offset:offset + len(names)],
+                {"income": models[2 * position], "expenditure": models[2 * position + 1]},
+            )
+            offset += len(names)
+    return results
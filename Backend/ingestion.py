@@ -0,0 +1,270 @@
+"""
+Incremental statement ingestion.
+
+Users routinely upload overlapping exports of the same account ("Last 3
+Months", then "6 Months"). The ledger remembers which pages and transactions
+are already indexed for a user and account, so an upload only embeds the
+portion that is new and links the rest to the nodes that already exist.
+Linked nodes can come from exports covering other periods, so rows that are
+not part of the statement are stripped from them before they are used.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import UpdateOne
+from llama_index.core import Document
+from llama_index.core.schema import MetadataMode
+from llama_index.core.settings import Settings
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from statements import Transaction, detect_account, keep_rows, page_fingerprint, parse_pages, strip_rows
+
+DEFAULT_ACCOUNT_ID = "default"
+
+
+@dataclass
+class IngestResult:
+    """Outcome of ingesting one statement."""
+    nodes: list
+    account_id: str = DEFAULT_ACCOUNT_ID
+    pages: list = field(default_factory=list)          # [(page_hash, text), ...] in PDF order
+    transactions: list = field(default_factory=list)   # every parsed row, known or new
+    new_transactions: list = field(default_factory=list)
+    embedded_nodes: int = 0
+    reused_nodes: int = 0
+
+
+class StatementLedger:
+    """Tracks indexed pages, transactions and statements per user and account."""
+    def __init__(self, database, vector_collection, vector_store, call=None,
+                 embedding_key="embedding", index_version=None):
+        self.pages = database["statement_pages"]
+        self.transactions = database["statement_transactions"]
+        self.statements = database["statements"]
+        self.vector_collection = vector_collection
+        self.vector_store = vector_store
+        # Wrapper for outbound embedding calls (e.g. ResilientCaller.call)
+        self.call = call or (lambda fn, *args, **kwargs: fn(*args, **kwargs))
+        # After an embedding migration, ledger node ids resolve to the re-chunked
+        # nodes of the served version through metadata.source_id.
+        self.embedding_key = embedding_key
+        self.index_version = index_version
+
+        self.pages.create_index(
+            [("user_id", pymongo.ASCENDING), ("account_id", pymongo.ASCENDING), ("page_hash", pymongo.ASCENDING)],
+            unique=True,
+        )
+        self.transactions.create_index(
+            [("user_id", pymongo.ASCENDING), ("account_id", pymongo.ASCENDING), ("fingerprint", pymongo.ASCENDING)],
+            unique=True,
+        )
+        self.transactions.create_index([("user_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)])
+        self.statements.create_index("pdf_id", unique=True)
+        # Node lookups by id, and by source_id after a migration, must not scan the collection.
+        self.vector_collection.create_index("id")
+        self.vector_collection.create_index("metadata.source_id")
+
+    def ingest(self, documents, user_id, pdf_id, filename, account_id=None):
+        """
+        Index the parts of `documents` (one per PDF page) not seen before and
+        record the statement as linked to every node that covers its content.
+        """
+        page_texts = [doc.text for doc in documents]
+        account_id = account_id or detect_account("\n".join(page_texts)) or DEFAULT_ACCOUNT_ID
+        scope = {"user_id": user_id, "account_id": account_id}
+
+        parsed = parse_pages(page_texts)
+        page_hashes = [page_fingerprint(text) for text in page_texts]
+        known_pages = {
+            page["page_hash"]: page
+            for page in self.pages.find({**scope, "page_hash": {"$in": page_hashes}})
+        }
+        fingerprints = [row.fingerprint for rows in parsed for row in rows]
+        known_rows = {
+            txn["fingerprint"]: txn["page_hash"]
+            for txn in self.transactions.find(
+                {**scope, "fingerprint": {"$in": fingerprints}},
+                {"fingerprint": 1, "page_hash": 1},
+            )
+        }
+
+        linked_pages = set()
+        new_documents, new_rows = [], []
+        for doc, page_hash, rows in zip(documents, page_hashes, parsed):
+            seen = [row for row in rows if row.fingerprint in known_rows]
+            unrecorded = [row for row in rows if row.fingerprint not in known_rows]
+            # Rows stripped from a page when it was first embedded live on the
+            # pages they were indexed with, so those are linked even for known pages.
+            linked_pages.update(known_rows[row.fingerprint] for row in seen)
+            if page_hash in known_pages:
+                # Already embedded; record any of its rows an interrupted ingest missed.
+                linked_pages.add(page_hash)
+                new_rows.extend((page_hash, row) for row in unrecorded)
+                continue
+            if rows and not unrecorded:
+                # Different layout, but every transaction on it is indexed already.
+                continue
+
+            text = strip_rows(doc.text, seen) if seen else doc.text
+            metadata = {**doc.metadata, "filename": filename, "user_id": user_id,
+                        "account_id": account_id, "page_hash": page_hash}
+            new_documents.append(Document(
+                text=text,
+                metadata=metadata,
+                excluded_embed_metadata_keys=list(doc.excluded_embed_metadata_keys) + ["page_hash"],
+                excluded_llm_metadata_keys=list(doc.excluded_llm_metadata_keys) + ["page_hash"],
+            ))
+            new_rows.extend((page_hash, row) for row in unrecorded)
+
+        transactions = [row for rows in parsed for row in rows]
+        reused = self.restrict(self.load_nodes(self._page_node_ids(scope, linked_pages)), transactions)
+        fresh = self._embed(new_documents)
+        self._record(scope, pdf_id, filename, fresh, new_rows)
+
+        nodes = reused + fresh
+        self.statements.insert_one({
+            **scope,
+            "pdf_id": pdf_id,
+            "filename": filename,
+            "page_hashes": list(dict.fromkeys(page_hashes)),
+            "node_ids": [node.node_id for node in nodes],
+            "transaction_fingerprints": fingerprints,
+            "created_at": datetime.now(timezone.utc),
+        })
+        return IngestResult(
+            nodes=nodes,
+            account_id=account_id,
+            pages=list(zip(page_hashes, page_texts)),
+            transactions=transactions,
+            new_transactions=[row for _, row in new_rows],
+            embedded_nodes=len(fresh),
+            reused_nodes=len(reused),
+        )
+
+    def annotate(self, pdf_id, **fields):
+        """Attach derived data (e.g. summary keys) to a statement record."""
+        self.statements.update_one({"pdf_id": pdf_id}, {"$set": fields})
+
+    def statement(self, pdf_id):
+        return self.statements.find_one({"pdf_id": pdf_id}, {"_id": 0})
+
+    def month_transactions(self, user_id, months):
+        """Every recorded transaction of a user (all accounts) in the given months."""
+        cursor = self.transactions.find(
+            {"user_id": user_id, "month": {"$in": list(months)}},
+            {"_id": 0, "date": 1, "description": 1, "amount": 1, "balance": 1, "category": 1, "fingerprint": 1},
+        )
+        return [Transaction(span=None, **doc) for doc in cursor]
+
+    def statement_nodes(self, pdf_id):
+        """Rebuild the nodes of a previously ingested statement, embeddings included."""
+        statement = self.statements.find_one(
+            {"pdf_id": pdf_id},
+            {"node_ids": 1, "user_id": 1, "account_id": 1, "transaction_fingerprints": 1},
+        )
+        if not statement:
+            return None
+        cursor = self.transactions.find(
+            {"user_id": statement["user_id"], "account_id": statement["account_id"],
+             "fingerprint": {"$in": statement.get("transaction_fingerprints", [])}},
+            {"_id": 0, "date": 1, "description": 1, "amount": 1, "balance": 1, "category": 1, "fingerprint": 1},
+        )
+        transactions = [Transaction(span=None, **doc) for doc in cursor]
+        return self.restrict(self.load_nodes(statement["node_ids"]), transactions)
+
+    def restrict(self, nodes, transactions):
+        """Copies of `nodes` with rows that are not among `transactions` stripped from their text."""
+        if not transactions:
+            return nodes
+        restricted = []
+        for node in nodes:
+            text = keep_rows(node.text, transactions)
+            restricted.append(node if text == node.text else node.model_copy(update={"text": text}))
+        return restricted
+
+    def load_nodes(self, node_ids):
+        if not node_ids:
+            return []
+        node_ids = list(node_ids)
+        query = {"id": {"$in": node_ids}}
+        if self.index_version:
+            query = {"$or": [
+                query,
+                {"metadata.source_id": {"$in": node_ids}, "metadata.index_version": self.index_version},
+            ]}
+        nodes = []
+        cursor = self.vector_collection.find(
+            {**query, self.embedding_key: {"$exists": True}},
+            {"_id": 0, "text": 1, "metadata": 1, self.embedding_key: 1},
+        )
+        for doc in cursor:
+            node = metadata_dict_to_node(doc["metadata"], text=doc["text"])
+            node.embedding = doc.get(self.embedding_key)
+            nodes.append(node)
+        return nodes
+
+    def _page_node_ids(self, scope, page_hashes):
+        if not page_hashes:
+            return []
+        node_ids = []
+        for page in self.pages.find({**scope, "page_hash": {"$in": list(page_hashes)}}, {"node_ids": 1}):
+            node_ids.extend(page["node_ids"])
+        return list(dict.fromkeys(node_ids))
+
+    def _embed(self, documents):
+        if not documents:
+            return []
+        nodes = Settings.node_parser.get_nodes_from_documents(documents)
+        if self.index_version:
+            # Tag new nodes like migrate_embeddings.py tags migrated ones, so the
+            # next migration (--source-version <this version>) includes them.
+            for node in nodes:
+                node.metadata["source_id"] = node.node_id
+                node.metadata["index_version"] = self.index_version
+                node.excluded_embed_metadata_keys = list(node.excluded_embed_metadata_keys) + ["source_id", "index_version"]
+                node.excluded_llm_metadata_keys = list(node.excluded_llm_metadata_keys) + ["source_id", "index_version"]
+        # One call per embedding request, so the caller's deadline, retries and
+        # hedges apply to a single HTTP batch rather than the whole statement.
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        batch_size = Settings.embed_model.embed_batch_size
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            embeddings.extend(self.call(Settings.embed_model.get_text_embedding_batch, texts[start:start + batch_size]))
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        self.vector_store.add(nodes)
+        return nodes
+
+    def _record(self, scope, pdf_id, filename, nodes, new_rows):
+        now = datetime.now(timezone.utc)
+        node_ids_by_page = {}
+        for node in nodes:
+            node_ids_by_page.setdefault(node.metadata["page_hash"], []).append(node.node_id)
+
+        # Upserts keep concurrent or retried uploads of overlapping statements
+        # from failing on the unique indexes; the first writer's record wins.
+        # Pages go first: if the row write then fails, a retry finds the page
+        # known and records its missing rows (see ingest).
+        if node_ids_by_page:
+            self.pages.bulk_write([
+                UpdateOne(
+                    {**scope, "page_hash": page_hash},
+                    {"$setOnInsert": {"node_ids": node_ids, "pdf_id": pdf_id, "filename": filename, "created_at": now}},
+                    upsert=True,
+                )
+                for page_hash, node_ids in node_ids_by_page.items()
+            ], ordered=False)
+        if new_rows:
+            self.transactions.bulk_write([
+                UpdateOne(
+                    {**scope, "fingerprint": row.fingerprint},
+                    {"$setOnInsert": {
+                        "page_hash": page_hash, "date": row.date, "month": row.month,
+                        "description": row.description, "amount": row.amount, "balance": row.balance,
+                        "category": row.category, "pdf_id": pdf_id, "created_at": now,
+                    }},
+                    upsert=True,
+                )
+                for page_hash, row in new_rows
+            ], ordered=False)
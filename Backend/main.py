@@ -1,6 +1,10 @@
 import re
 import os
 import io
+import sys
+import hmac
+import json
+import time
 import uuid
 import requests
 import pymongo
@@ -27,6 +31,7 @@ from llama_index.core import (
     SummaryIndex,
 )
 from llama_index.core.settings import Settings
+from llama_index.core.schema import QueryBundle
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.vector_stores import (
     MetadataFilter,
@@ -50,6 +55,27 @@ from llama_index.llms.azure_openai import AzureOpenAI
 from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
 from llama_index.vector_stores.mongodb import MongoDBAtlasVectorSearch
 
+import precompute
+from answer_store import PrecomputedStore
+from forecasting import DEFAULT_HORIZON, forecast_user
+from ingestion import StatementLedger
+from metrics import metrics
+from migrate_embeddings import record_serving
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientCaller
+from scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerOverloaded
+from prompts import (
+    CHAT_RESPONSE_FORMAT,
+    CHAT_SYSTEM_PROMPT,
+    INSIGHTS_SYSTEM_PROMPT,
+    PromptCompiler,
+    TokenBudgetPostprocessor,
+    context_tokens,
+    count_tokens,
+)
+from rollups import DASHBOARD_MONTHS, UserRollupStore
+from summaries import StatementSummaryStore, StoredSummaryQueryEngine
+from transactions import SORT_FIELDS, MAX_PAGE_SIZE, TransactionQueryEngine, TransactionStore
+
 # ============================================================================
 # Environment Variables & Configurations
 # ============================================================================
@@ -74,10 +100,24 @@ FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY")
 # Google OAuth Redirect URI
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 
+# Embedding index version. Set by migrate_embeddings.py at cutover: each version
+# keeps its vectors in its own field and Atlas search index.
+EMBEDDING_VERSION = os.getenv("EMBEDDING_VERSION")
+EMBEDDING_DEPLOYMENT = os.getenv("EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
+EMBEDDING_FIELD = f"embedding_{EMBEDDING_VERSION}" if EMBEDDING_VERSION else "embedding"
+VECTOR_INDEX_NAME = (
+    f"vector_index_hacklytics_{EMBEDDING_VERSION}" if EMBEDDING_VERSION else "vector_index_hacklytics"
+)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1024"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "10"))
+
 # Upload Folder
 UPLOAD_FOLDER = "backend/uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Columnar transaction partitions (user/month) behind /api/transactions
+TRANSACTIONS_FOLDER = "backend/transactions"
+
 # ============================================================================
 # Flask App & Extensions Setup
 # ============================================================================
@@ -94,7 +134,7 @@ login_manager.init_app(app)
 # ============================================================================
 
 # In-memory chat histories and PDF indexes per user
-chat_histories = {}  # Format: { user_id: [ {"role": "user"/"assistant", "content": "..."}, ... ] }
+chat_histories = {}  # Format: { pdf_id: [ (question, answer), ... ] }
 pdf_indexes = {}     # Format: { pdf_id: LlamaIndex }
 
 # In-memory user store (for demo purposes)
@@ -113,6 +153,29 @@ def load_user(user_id):
 # Global variable for current user id
 global_current_user_id = None
 
+# Demo user for requests made without logging in. An explicit `user_id` in
+# the request is only trusted in demo mode (ALLOW_USER_ID_PARAM=1), since it
+# would otherwise expose any user's statements to anonymous callers.
+DEFAULT_USER_ID = "3"
+ALLOW_USER_ID_PARAM = os.getenv("ALLOW_USER_ID_PARAM") == "1"
+
+def request_user_id(payload):
+    """The logged-in user, else (demo mode only) the payload's `user_id`, else the demo user."""
+    if current_user.is_authenticated:
+        return str(current_user.id)
+    if ALLOW_USER_ID_PARAM and payload.get("user_id"):
+        return str(payload["user_id"])
+    return DEFAULT_USER_ID
+
+def request_tenant(user_id):
+    """
+    Scheduler tenant for a request. Anonymous callers all share the demo
+    user's data, so they are told apart by client address instead.
+    """
+    if current_user.is_authenticated or user_id != DEFAULT_USER_ID:
+        return user_id
+    return f"anon:{request.remote_addr}"
+
 # ============================================================================
 # Azure Blob Storage Service
 # ============================================================================
@@ -165,38 +228,119 @@ except Exception as e:
 # Llama Index & MongoDB Atlas Setup
 # ============================================================================
 
-# Configure LlamaIndex settings with Azure OpenAI and embedding
-Settings.llm = AzureOpenAI(
-    model="gpt-4o",
-    deployment_name="gpt-4o",
-    api_key=OPENAI_API_KEY,
-    azure_endpoint=azure_endpoint,
-    api_version=api_version,
+# Per-call deadlines; retries, hedging and circuit breaking happen in the
+# ResilientCallers below, so the SDK clients do not retry on their own.
+LLM_DEADLINE_SECONDS = 60
+INSIGHTS_DEADLINE_SECONDS = 120
+EMBED_DEADLINE_SECONDS = 30
+
+# One circuit breaker per dependency, but one caller per call site: each hedges
+# against its own latency percentiles, since a long insights call is not slow
+# by chat standards.
+llm_breaker = CircuitBreaker()
+chat_caller = ResilientCaller("llm_chat", deadline=LLM_DEADLINE_SECONDS, breaker=llm_breaker)
+# Summaries are batch work: a hedge would be a second LLM call the scheduler never admitted.
+summary_caller = ResilientCaller("llm_summary", deadline=LLM_DEADLINE_SECONDS, hedge=False, breaker=llm_breaker)
+insights_caller = ResilientCaller("llm_insights", deadline=INSIGHTS_DEADLINE_SECONDS, breaker=llm_breaker)
+embed_caller = ResilientCaller("embedding", deadline=EMBED_DEADLINE_SECONDS)
+
+# Nightly precompute runs inside this process (triggered via /api/precompute)
+# as its own batch tenant, with a larger quota than a single user.
+PRECOMPUTE_TOKEN = os.getenv("PRECOMPUTE_TOKEN")
+PRECOMPUTE_CONCURRENCY = int(os.getenv("PRECOMPUTE_CONCURRENCY", "4"))
+
+# All LLM-bound work is admitted through one scheduler: chat is interactive,
+# ingestion, insights and precompute are batch. Batch work can never take the
+# reserved workers.
+llm_scheduler = LLMScheduler(
+    workers=int(os.getenv("LLM_WORKERS", "8")),
+    reserved_interactive=2,
+    per_user_limit=2,
+    limits={precompute.TENANT: PRECOMPUTE_CONCURRENCY},
 )
 
+def azure_llm(timeout):
+    """gpt-4o client whose per-attempt HTTP timeout matches its caller's deadline."""
+    return AzureOpenAI(
+        model="gpt-4o",
+        deployment_name="gpt-4o",
+        api_key=OPENAI_API_KEY,
+        azure_endpoint=azure_endpoint,
+        api_version=api_version,
+        timeout=timeout,
+        max_retries=0,
+    )
+
+# Configure LlamaIndex settings with Azure OpenAI and embedding
+Settings.llm = azure_llm(LLM_DEADLINE_SECONDS)
+insights_llm = azure_llm(INSIGHTS_DEADLINE_SECONDS)
+
 Settings.embed_model = AzureOpenAIEmbedding(
-    model="text-embedding-ada-002",
-    deployment_name="text-embedding-ada-002",
+    model=EMBEDDING_DEPLOYMENT,
+    deployment_name=EMBEDDING_DEPLOYMENT,
     api_key=OPENAI_API_KEY,
     azure_endpoint=azure_endpoint,
     api_version=api_version,
+    timeout=EMBED_DEADLINE_SECONDS,
+    max_retries=0,
+)
+Settings.chunk_size = CHUNK_SIZE
+Settings.chunk_overlap = CHUNK_OVERLAP
+
+# Prompt compilers: static instructions form a fixed system prefix (cacheable
+# provider-side); retrieved context and history are trimmed to token budgets.
+CHAT_CONTEXT_TOKENS = 6000
+INSIGHTS_CONTEXT_TOKENS = 60000
+QUERY_TEMPLATE_BODY = (
+    "Context information from the bank statement is below.\n"
+    "---------------------\n"
+    "{context_str}\n"
+    "---------------------\n"
+    "{query_str}"
 )
-Settings.chunk_size = 1024
-Settings.chunk_overlap = 10
+
+chat_compiler = PromptCompiler(CHAT_SYSTEM_PROMPT, suffix=CHAT_RESPONSE_FORMAT)
+chat_query_template = chat_compiler.query_template(QUERY_TEMPLATE_BODY)
+insights_compiler = PromptCompiler(INSIGHTS_SYSTEM_PROMPT, context_budget=INSIGHTS_CONTEXT_TOKENS)
 
 # MongoDB Atlas Connection and Collection
 mongo_client = pymongo.MongoClient(ATLAS_CONNECTION_STRING)
 atlas_collection = mongo_client["user_data"]["user_data"]
+# Lets migrate_embeddings.py cleanup confirm the old vectors are no longer served
+record_serving(mongo_client["user_data"], EMBEDDING_VERSION)
 
 # Instantiate the vector store
 atlas_vector_store = MongoDBAtlasVectorSearch(
     mongo_client,
     db_name="user_data",
     collection_name="user_data",
-    vector_index_name="vector_index_hacklytics"
+    vector_index_name=VECTOR_INDEX_NAME,
+    embedding_key=EMBEDDING_FIELD,
 )
 vector_store_context = StorageContext.from_defaults(vector_store=atlas_vector_store)
 
+# Ledger of already-indexed pages and transactions, for incremental ingestion
+statement_ledger = StatementLedger(
+    mongo_client["user_data"],
+    atlas_collection,
+    atlas_vector_store,
+    call=embed_caller.call,
+    embedding_key=EMBEDDING_FIELD,
+    index_version=EMBEDDING_VERSION,
+)
+
+# Page/month/statement summaries built at ingest for summarization questions
+statement_summaries = StatementSummaryStore(mongo_client["user_data"], call=summary_caller.call)
+
+# Insights and suggested-question answers precomputed by precompute.py
+precomputed = PrecomputedStore(mongo_client["user_data"])
+
+# Monthly per-user aggregates backing the multi-statement dashboard
+user_rollups = UserRollupStore(mongo_client["user_data"])
+
+# Parsed transactions in a columnar store for filtered lookups
+transaction_store = TransactionStore(TRANSACTIONS_FOLDER)
+
 chat_sessions = {}
 
 def get_vector_store_index(user_id, filename):
@@ -204,10 +348,12 @@ def get_vector_store_index(user_id, filename):
     Fetch all documents (ingested PDFs) for the given user_id and filename from MongoDB,
     convert them into Llama Index Document objects, and rebuild the vector store index.
     """
-    docs = list(atlas_collection.find({
-        "metadata.user_id": user_id,
-        "metadata.filename": filename
-    }))
+    # Stream text and metadata only; stored embeddings stay on the server.
+    docs = atlas_collection.find(
+        {"metadata.user_id": user_id, "metadata.filename": filename},
+        projection={"_id": 0, "text": 1, "metadata": 1},
+        batch_size=256,
+    )
     documents = []
     for doc in docs:
         doc_text = doc.get("text", "")
@@ -215,7 +361,7 @@ def get_vector_store_index(user_id, filename):
         documents.append(Document(text=doc_text, metadata=doc_metadata))
     
     if documents:
-        text_splitter = SentenceSplitter(chunk_size=1024)
+        text_splitter = SentenceSplitter(chunk_size=CHUNK_SIZE)
         vector_index = VectorStoreIndex.from_documents(
             documents,
             storage_context=vector_store_context,
@@ -226,6 +372,146 @@ def get_vector_store_index(user_id, filename):
     else:
         return None
 
+def get_statement_index(pdf_id, cache=True):
+    """
+    Return the in-memory index for a statement, rebuilding it from the ledger
+    (stored embeddings, no embedding calls) if this process has not seen it.
+    """
+    vector_index = pdf_indexes.get(pdf_id)
+    if vector_index is None:
+        nodes = statement_ledger.statement_nodes(pdf_id)
+        if not nodes:
+            return None
+        vector_index = VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults())
+        if cache:
+            pdf_indexes[pdf_id] = vector_index
+    return vector_index
+
+def record_prompt_metrics(endpoint, started, compiled, completion, retrieved_tokens=0):
+    """Record latency and per-section token counts for one LLM-backed request."""
+    sections = {f"{name}_tokens": count for name, count in compiled.sections.items()}
+    if retrieved_tokens:
+        sections["context_tokens"] = sections.get("context_tokens", 0) + retrieved_tokens
+    metrics.record(
+        endpoint,
+        (time.perf_counter() - started) * 1000,
+        prompt_tokens=compiled.total_tokens + retrieved_tokens,
+        completion_tokens=count_tokens(completion),
+        **sections,
+    )
+
+def build_chat_engine(pdf_id, vector_index, question=""):
+    """Router over the stored-summary, retrieval and transaction-lookup tools for one statement."""
+    # Summarization questions are answered from the summaries stored at ingest;
+    # statements ingested before those existed fall back to tree_summarize.
+    statement = statement_ledger.statement(pdf_id) or {}
+    summaries = statement_summaries.render(statement.get("summary_keys"))
+    if summaries:
+        list_query_engine = StoredSummaryQueryEngine(summaries=summaries, system_prompt=chat_compiler.system)
+    else:
+        nodes = list(vector_index.docstore.docs.values())
+        list_query_engine = SummaryIndex(nodes).as_query_engine(
+            response_mode="tree_summarize",
+            summary_template=chat_query_template,
+            use_async=True,
+        )
+    # The statement index already holds embedded nodes, so nothing is re-embedded here.
+    vector_query_engine = vector_index.as_query_engine(
+        text_qa_template=chat_query_template,
+        node_postprocessors=[TokenBudgetPostprocessor(max_tokens=CHAT_CONTEXT_TOKENS)],
+    )
+
+    list_tool = QueryEngineTool.from_defaults(
+        query_engine=list_query_engine,
+        description=(
+            "Useful for summarization questions related to the bank statement that the user has uploaded."
+        ),
+    )
+
+    vector_tool = QueryEngineTool.from_defaults(
+        query_engine=vector_query_engine,
+        description=(
+            "Useful for retrieving specific context about the bank statement that the user has uploaded."
+        ),
+    )
+
+    tools = [list_tool, vector_tool]
+    if statement.get("user_id") is not None and transaction_store.months(statement["user_id"]):
+        transaction_query_engine = TransactionQueryEngine(
+            store=transaction_store,
+            user_id=str(statement["user_id"]),
+            account_id=statement.get("account_id"),
+            question=question,
+        )
+        tools.append(QueryEngineTool.from_defaults(
+            query_engine=transaction_query_engine,
+            description=(
+                "Useful for listing, counting or totalling specific transactions in the bank statement, "
+                "filtered by date range, amount, merchant or category."
+            ),
+        ))
+
+    return RouterQueryEngine(
+        selector=PydanticSingleSelector.from_defaults(),
+        query_engine_tools=tools,
+    )
+
+def answer_question(pdf_id, vector_index, question, history, tenant, priority=INTERACTIVE):
+    """Answer one chat question about a statement as an HTML string, scheduled for `tenant`."""
+    query_engine = build_chat_engine(pdf_id, vector_index, question)
+
+    started = time.perf_counter()
+    compiled = chat_compiler.compile(question=question, history=history)
+
+    # Retrieve on the question alone; history and formatting only go to the LLM.
+    response = llm_scheduler.run(
+        tenant, priority,
+        chat_caller.call, query_engine.query,
+        QueryBundle(query_str=compiled.user, custom_embedding_strs=[question]),
+    )
+    answer = re.sub(r"```[a-zA-Z]*\n?|```", "", str(response))
+    answer = re.sub(r"^#+\s*", "", answer, flags=re.MULTILINE)
+    record_prompt_metrics("chat", started, compiled, answer, context_tokens(response.source_nodes))
+    return answer
+
+def compute_insights(vector_index, tenant):
+    """Chart data for one statement from a single LLM call; {} if the reply is not valid JSON."""
+    docs = vector_index.storage_context.docstore.docs.values()
+    full_text = "\n".join([doc.text for doc in docs])
+
+    started = time.perf_counter()
+    compiled = insights_compiler.compile(
+        context=full_text,
+        context_header="The overall bank statement text is provided below:",
+    )
+    response = llm_scheduler.run(
+        tenant, BATCH,
+        # Never hedged: a duplicate of a 60k-token request doubles its cost.
+        lambda: insights_caller.call(insights_llm.chat, compiled.messages(), hedge=False),
+        cost=max(1, compiled.total_tokens // 4000),
+    )
+    insights_json = response.message.content.strip()
+    if insights_json.startswith("```json"):
+        insights_json = insights_json[7:]
+    if insights_json.endswith("```"):
+        insights_json = insights_json[:-3]
+    record_prompt_metrics("insights", started, compiled, insights_json)
+
+    try:
+        insights_data = json.loads(insights_json)
+        print(insights_data)
+    except json.JSONDecodeError as e:
+        print("Error parsing JSON:", e)
+        insights_data = {}
+    return insights_data
+
+def store_summary_keys(pdf_id, job):
+    """Attach the summaries built in the background to the statement record."""
+    try:
+        statement_ledger.annotate(pdf_id, summary_keys=job.result())
+    except Exception as e:
+        print(f"Failed to build statement summaries: {str(e)}")
+
 # ============================================================================
 # API Endpoints
 # ============================================================================
@@ -246,7 +532,8 @@ def upload_pdf():
     file_path = os.path.join(UPLOAD_FOLDER, filename)
     file.save(file_path)
 
-    user_id = 3
+    user_id = request_user_id(request.form)
+    tenant = request_tenant(user_id)
 
     # Load the PDF using SimpleDirectoryReader
     try:
@@ -254,26 +541,53 @@ def upload_pdf():
     except Exception as e:
         return jsonify({"error": f"Failed to load PDF: {str(e)}"}), 500
 
-    # Add metadata to each document
-    for doc in documents:
-        doc.metadata["filename"] = filename
-        doc.metadata["user_id"] = user_id
+    pdf_id = str(uuid.uuid4())
 
-    # Build the vector index from the documents
+    # Embed only pages/transactions not already indexed for this user and account,
+    # then build the index over the new nodes plus the existing ones they overlap.
     try:
-        vector_index = VectorStoreIndex.from_documents(
-            documents,
-            service_context=vector_store_context,
-            show_progress=True
+        account_id = request.form.get("account_id")
+        result = llm_scheduler.run(
+            tenant, BATCH,
+            lambda: statement_ledger.ingest(
+                documents, user_id=user_id, pdf_id=pdf_id, filename=filename, account_id=account_id
+            ),
+            cost=len(documents),
+        )
+        # Both writes are idempotent and cover every parsed row, so retrying an
+        # upload whose earlier attempt failed here repairs the missing months.
+        transaction_store.append(user_id, result.account_id, result.transactions)
+        months = sorted({row.month for row in result.transactions})
+        user_rollups.replace_months(user_id, months, statement_ledger.month_transactions(user_id, months))
+        vector_index = VectorStoreIndex(
+            result.nodes,
+            storage_context=StorageContext.from_defaults(),
+            show_progress=False
         )
+    except (CircuitOpenError, DeadlineExceeded, SchedulerOverloaded):
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to build index: {str(e)}"}), 500
 
-    pdf_id = str(uuid.uuid4())
+    # Summaries are only an optimisation for chat, so they are built in the
+    # background; until they exist chat falls back to tree_summarize.
+    summary_job = llm_scheduler.submit(
+        tenant, BATCH,
+        statement_summaries.build, user_id, result.account_id, result.pages, result.transactions,
+        cost=len(documents),
+    )
+    summary_job.add_done_callback(lambda job: store_summary_keys(pdf_id, job))
+
     pdf_indexes[pdf_id] = vector_index
-    chat_histories[pdf_id] = ""  # initialize empty conversation context
+    chat_histories[pdf_id] = []  # initialize empty conversation context
     print(pdf_id)
-    return jsonify({"message": "PDF uploaded and indexed successfully", "pdf_id": pdf_id}), 200
+    return jsonify({
+        "message": "PDF uploaded and indexed successfully",
+        "pdf_id": pdf_id,
+        "embedded_nodes": result.embedded_nodes,
+        "reused_nodes": result.reused_nodes,
+        "new_transactions": len(result.new_transactions),
+    }), 200
 
 @app.route("/api/chat", methods=["POST"])
 def chat_with_pdf():
@@ -291,76 +605,19 @@ def chat_with_pdf():
     if not pdf_id or not question:
         return jsonify({"error": "pdf_id and question are required"}), 400
 
-    vector_index = pdf_indexes.get(pdf_id)
+    vector_index = get_statement_index(pdf_id)
     if not vector_index:
         return jsonify({"error": "Invalid pdf_id"}), 404
-    
-    documents = vector_index.storage_context.docstore.docs.values()
-    nodes = Settings.node_parser.get_nodes_from_documents(documents)
-    storage_context = StorageContext.from_defaults()
-    storage_context.docstore.add_documents(nodes)
-    summary_index = SummaryIndex(nodes, storage_context=storage_context)
-    vector_query_index = VectorStoreIndex(nodes, storage_context=storage_context)
-    
-    list_query_engine = summary_index.as_query_engine(
-        response_mode="tree_summarize",
-        use_async=True,
-    )
-    vector_query_engine = vector_query_index.as_query_engine()
 
-    list_tool = QueryEngineTool.from_defaults(
-        query_engine=list_query_engine,
-        description=(
-            "Useful for summarization questions related to the bank statement that the user has uploaded."
-        ),
-    )
-
-    vector_tool = QueryEngineTool.from_defaults(
-        query_engine=vector_query_engine,
-        description=(
-            "Useful for retrieving specific context about the bank statement that the user has uploaded."
-        ),
-    )
-
-    query_engine = RouterQueryEngine(
-        selector=PydanticSingleSelector.from_defaults(),
-        query_engine_tools=[list_tool, vector_tool],
-    )
-
-    history = chat_histories.get(pdf_id, "")
-    prompt_template = """
-        You are an AI assistant helping users analyze their bank statements. The user has uploaded a PDF containing their financial transactions in their bank statement. 
-        Your role is to provide clear, concise, and insightful answers based on the document.
-        Context:
-        - The PDF contains financial transactions, including income, expenses, and other financial activities.
-        - Transactions may include merchant names, dates, amounts, and categories.
-        - The user may ask about their spending habits, category-wise breakdowns, unusual transactions, trends, and budget insights.
-        - Ensure responses are factual, analytical, and directly based on the provided data.
-        The user can ask questions such as :
-        - "What was my total expenditure last month?"
-        - "Break down my expenses into categories."
-        - "Find unusual or large transactions."
-        - "Compare my spending between two months."
-        - "Identify my top 5 spending categories."
-        - If a question requires comparisons, ensure that you summarize the trend based on available data.
-        Response Guidelines:
-        1. Be Data-Driven - Ensure that answers are only based on the bank statement data.
-        2. Be Concise & Structured - If applicable, provide information in bullets or tables.
-        3. Ensure Clarity - Avoid ambiguity and respond in simple, easy-to-understand language.
-        4. Highlight Trends & Insights - If patterns exist in spending, mention them.
-        MAKE SURE YOU PROPERLY READ THE DOCUMENT AND UNDERSTAND ALL OF THE INFORMATION.
-        DO NOT HALLUCINATE OR PROVIDE FALSE INFORMATION. IF THE DATA IS NOT AVAILABLE, STATE THAT THE INFORMATION IS NOT IN THE DOCUMENT.
-        YOU SHOULD SEND THE RESPONSE AS A PLAIN HTML STRING and MAKE SURE YOU INCLUDE ALL THE HTML INSIDE A <div> </div> use any headers of h3 size and lower like h4 etc. DO NOT INCLUDE ANY EXPLANATIONS OR EXTRA TEXT OUTSIDE HTML.
-    """
-    prompt = (prompt_template + "chat history till now : " + history +
-              f"Current Question that the user is asking Q: {question}" +
-              "Please provide your response in plain HTML format only inside <div> </div> and since we are displaying this on chatbot, use any headers of h3 size and lower like h4 etc. Do not include any explanations or extra text outside HTML.")
-
-    response = query_engine.query(prompt)
-    answer = re.sub(r"```[a-zA-Z]*\n?|```", "", str(response))
-    answer = re.sub(r"^#+\s*", "", answer, flags=re.MULTILINE)
+    # Opening questions from the advertised list are answered from storage.
+    history = chat_histories.get(pdf_id, [])
+    answer = None if history else precomputed.answer(pdf_id, question)
+    if answer is not None:
+        metrics.increment("chat", "precomputed_hits")
+    else:
+        answer = answer_question(pdf_id, vector_index, question, history, request_tenant(request_user_id(data)))
 
-    history += f"Q: {question}\nA: {answer}\n"
+    history.append((question, answer))
     chat_histories[pdf_id] = history
 
     return jsonify({"answer": answer}), 200
@@ -369,6 +626,7 @@ def chat_with_pdf():
 def get_insights():
     """
     Extract insights from an ingested bank/credit card statement PDF.
+    Served from the precomputed store when available; otherwise computed and stored.
     Expected JSON payload:
     {
       "pdf_id": "<id returned by /api/upload>"
@@ -379,106 +637,171 @@ def get_insights():
     if not pdf_id:
         return jsonify({"error": "pdf_id is required"}), 400
 
-    vector_index = pdf_indexes.get(pdf_id)
+    insights_data = precomputed.insights(pdf_id)
+    if insights_data is not None:
+        metrics.increment("insights", "precomputed_hits")
+        return jsonify(insights_data), 200
+
+    vector_index = get_statement_index(pdf_id)
     if not vector_index:
         return jsonify({"error": "Invalid pdf_id"}), 404
 
-    docs = vector_index.storage_context.docstore.docs.values()
-    full_text = "\n".join([doc.text for doc in docs])
+    insights_data = compute_insights(vector_index, request_tenant(request_user_id(data)))
+    if insights_data:
+        precomputed.save_insights(pdf_id, insights_data)
+    return jsonify(insights_data), 200
 
-    prompt_template = """
-    You are an expert financial analyst.
-    Given the bank statement text below, extract and compute the following insights strictly in valid JSON format without any additional commentary, explanations, or extra text.
-    Chart Data Format:
-    Include chart data in the following format:
-    The first line chart should include 12 entries, one for each month of the year.
-    Each entry should have three keys: "name" (the month name), "Income" (the total income for that month), and "Expenditure" (the total expenditure for that month).
-    The second bar chart should include 5 entries, where you give the top 5 categories that have the most expenses.
-    Each entry should have two keys: "name" (the category name) and "amount" (the total amount spent in that particular category).
-    The third pie chart should take all the expenses and then accumulate them into categories.
-    Each entry should have two keys: "name" (the category name) and "amount" (the total amount spent in that particular category).
-    Try and put similar categories together and then provide the total amount spent in each category.
-    The fourth line chart will have the savings for each month. Essentially this will just be the difference between the income and the expenditure for each month that you calculated in the first line chart.
-    Each entry should have three keys: "name" (the month name), "amount" (income-expenditure for that month).
-    Analyze all of the data and then find the common categories and accumulate them.
-    ```json
+@app.route("/api/insights/user", methods=["POST"])
+def get_user_insights():
+    """
+    Combined dashboard across every statement a user has uploaded, served from
+    the monthly rollups without any LLM call.
+    Expected JSON payload (user_id is only honoured in demo mode):
     {
-    "charts": {
-        "lineChart": {
-        "data": [
-            { "name": "January", "Income": 4000, "Expenditure": 2400 },
-            { "name": "February", "Income": 3000, "Expenditure": 1398 },
-            { "name": "March", "Income": 2000, "Expenditure": 9800 },
-            { "name": "April", "Income": 5000, "Expenditure": 3100 },
-            { "name": "May", "Income": 7000, "Expenditure": 4500 },
-            { "name": "June", "Income": 6500, "Expenditure": 4000 },
-            { "name": "July", "Income": 8000, "Expenditure": 5000 },
-            { "name": "August", "Income": 7200, "Expenditure": 4600 },
-            { "name": "September", "Income": 6800, "Expenditure": 4400 },
-            { "name": "October", "Income": 7500, "Expenditure": 4800 },
-            { "name": "November", "Income": 7800, "Expenditure": 5100 },
-            { "name": "December", "Income": 8200, "Expenditure": 5300 }
-        ]
-        },
-        "barChart": {
-        "data": [
-            { "name": "Rent", "amount": 1500 },
-            { "name": "Groceries", "amount": 800 },
-            { "name": "Transport", "amount": 600 },
-            { "name": "Entertainment", "amount": 400 },
-            { "name": "Utilities", "amount": 300 }
-        ]
-        },
-        "pieChart": {
-        "data": [
-            { "name": "Rent", "amount": 1500 },
-            { "name": "Groceries", "amount": 800 },
-            { "name": "Transport", "amount": 600 },
-            { "name": "Entertainment", "amount": 400 },
-            { "name": "Utilities", "amount": 300 }
-        ]
-        },
-        "savingsChart": {
-            "data": [
-            { "name": "January", "amount": 2400 },
-            { "name": "February", "amount": 1398 },
-            { "name": "March", "amount": 9800 },
-            { "name": "April", "amount": 3100 },
-            { "name": "May", "amount": 4500 },
-            { "name": "June", "amount": 4000 },
-            { "name": "July", "amount": 5000 },
-            { "name": "August", "amount": 4600 },
-            { "name": "September", "amount": 4400 },
-            { "name": "October", "amount": 4800 },
-            { "name": "November", "amount": 5100 },
-            { "name": "December", "amount": 5300 }
-        ]
-        }
-    }
+      "user_id": <user id>,
+      "months": 12 or 24
     }
-    Your JSON must include the three charts with the specified data format.
-    Do not include any additional text or explanations before or after the JSON.
-    Return only valid JSON.
     """
-    prompt = prompt_template + "\nThe overall bank statement text is provided below:\n" + full_text
+    data = request.get_json() or {}
+    user_id = request_user_id(data)
+    months = data.get("months", 12)
+    if months not in DASHBOARD_MONTHS:
+        return jsonify({"error": f"months must be one of {list(DASHBOARD_MONTHS)}"}), 400
 
-    query_engine = vector_index.as_query_engine(response_mode="compact")
-    response = query_engine.query(prompt)
-    insights_json = response.response.strip()
-    if insights_json.startswith("```json"):
-        insights_json = insights_json[7:]
-    if insights_json.endswith("```"):
-        insights_json = insights_json[:-3]
+    return jsonify(user_rollups.dashboard(user_id, months)), 200
 
+@app.route("/api/forecast", methods=["POST"])
+def get_forecast():
+    """
+    Forecast a user's income, expenditure, savings and category spend from
+    their monthly rollups using local statistical models (no LLM call).
+    Expected JSON payload (user_id is only honoured in demo mode):
+    {
+      "user_id": <user id>,
+      "horizon": <months ahead, 1-12, default 3>
+    }
+    """
+    data = request.get_json() or {}
+    user_id = request_user_id(data)
+    horizon = data.get("horizon", DEFAULT_HORIZON)
+    if not isinstance(horizon, int) or not 1 <= horizon <= 12:
+        return jsonify({"error": "horizon must be an integer between 1 and 12"}), 400
+
+    # The nightly job's forecast is served while no upload has changed the rollups since.
+    forecast = precomputed.forecast(user_id, horizon, since=user_rollups.last_updated(user_id))
+    if forecast is None:
+        forecast = forecast_user(user_rollups.monthly_series(user_id, max(DASHBOARD_MONTHS)), horizon)
+    if forecast is None:
+        return jsonify({"error": "No statement data for this user"}), 404
+    return jsonify(forecast), 200
+
+@app.route("/api/transactions", methods=["GET"])
+def get_transactions():
+    """
+    Filtered, sorted, paginated transactions across all of a user's statements.
+    Query parameters (all optional; user_id is only honoured in demo mode):
+      user_id, account_id,
+      start, end           inclusive dates, YYYY-MM-DD
+      min_amount, max_amount  bounds on the absolute amount
+      merchant             case-insensitive text in the description
+      category             e.g. Groceries
+      type                 debit | credit
+      sort                 date | -date | amount | -amount (default -date)
+      limit                page size, up to 500 (default 50)
+      cursor               next_cursor from the previous page
+    Returns {"transactions", "next_cursor", "total", "net_amount"}; total and
+    net_amount cover every match, not just the page.
+    """
+    args = request.args
+    user_id = request_user_id(args)
+    kind = args.get("type")
+    if kind not in (None, "debit", "credit"):
+        return jsonify({"error": "type must be debit or credit"}), 400
+    sort = args.get("sort", "-date")
+    if sort not in SORT_FIELDS:
+        return jsonify({"error": f"sort must be one of {list(SORT_FIELDS)}"}), 400
     try:
-        import json
-        insights_data = json.loads(insights_json)
-        print(insights_data)
-    except json.JSONDecodeError as e:
-        print("Error parsing JSON:", e)
-        insights_data = {}
+        limit = int(args.get("limit", 50))
+        min_amount = float(args["min_amount"]) if args.get("min_amount") else None
+        max_amount = float(args["max_amount"]) if args.get("max_amount") else None
+        for name in ("start", "end"):
+            if args.get(name):
+                time.strptime(args[name], "%Y-%m-%d")
+    except ValueError:
+        return jsonify({"error": "limit and amounts must be numbers, start and end dates YYYY-MM-DD"}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
 
-    return jsonify(insights_data), 200
+    try:
+        page = transaction_store.query(
+            user_id,
+            start=args.get("start"),
+            end=args.get("end"),
+            min_amount=min_amount,
+            max_amount=max_amount,
+            merchant=args.get("merchant"),
+            category=args.get("category"),
+            kind=kind,
+            account_id=args.get("account_id"),
+            sort=sort,
+            limit=limit,
+            cursor=args.get("cursor"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page), 200
+
+@app.route("/api/precompute", methods=["POST"])
+def start_precompute():
+    """
+    Start the insights/suggested-answer precompute job (see precompute.py) in
+    the background. Requires the X-Precompute-Token header.
+    Expected JSON payload:
+    {
+      "all": <recompute every statement, default false>,
+      "concurrency": <statements in parallel, default PRECOMPUTE_CONCURRENCY>
+    }
+    """
+    token = request.headers.get("X-Precompute-Token", "")
+    if not PRECOMPUTE_TOKEN or not hmac.compare_digest(token, PRECOMPUTE_TOKEN):
+        return jsonify({"error": "Forbidden"}), 403
+
+    data = request.get_json(silent=True) or {}
+    concurrency = data.get("concurrency", PRECOMPUTE_CONCURRENCY)
+    if not isinstance(concurrency, int) or not 1 <= concurrency <= 32:
+        return jsonify({"error": "concurrency must be an integer between 1 and 32"}), 400
+
+    if not precompute.start(sys.modules[__name__], all_statements=bool(data.get("all")), concurrency=concurrency):
+        return jsonify({"error": "Precompute is already running"}), 409
+    return jsonify({"message": "Precompute started"}), 202
+
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Per-endpoint and per-dependency request counts, latency percentiles
+    (p50/p95/p99), token totals, hedges/retries and circuit breaker state.
+    """
+    return jsonify({
+        **metrics.snapshot(),
+        "circuits": {caller.name: caller.status() for caller in (chat_caller, summary_caller, insights_caller, embed_caller)},
+        "scheduler": llm_scheduler.stats(),
+    }), 200
+
+@app.errorhandler(CircuitOpenError)
+def handle_circuit_open(e):
+    response = jsonify({"error": f"{e}, please retry shortly"})
+    response.headers["Retry-After"] = str(max(1, int(e.retry_after)))
+    return response, 503
+
+@app.errorhandler(SchedulerOverloaded)
+def handle_scheduler_overloaded(e):
+    response = jsonify({"error": f"{e}, please retry shortly"})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+@app.errorhandler(DeadlineExceeded)
+def handle_deadline_exceeded(e):
+    return jsonify({"error": str(e)}), 504
 
 # ============================================================================
 # Authentication Endpoints
@@ -0,0 +1,64 @@
+"""
+In-process request metrics.
+
+Keeps a bounded window of recent latencies per name (endpoint or LLM call
+site) for percentiles, plus running totals such as prompt tokens per section.
+"""
+import threading
+from collections import defaultdict, deque
+
+WINDOW = 2048
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class MetricsRegistry:
+    """Thread-safe latency windows and counters keyed by name."""
+    def __init__(self, window=WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._counters = defaultdict(lambda: defaultdict(float))
+
+    def record(self, name, latency_ms=None, **counters):
+        """Record one event: an optional latency and any numeric counters (summed)."""
+        with self._lock:
+            self._counters[name]["count"] += 1
+            if latency_ms is not None:
+                self._latencies[name].append(latency_ms)
+            for key, value in counters.items():
+                self._counters[name][key] += value
+
+    def increment(self, name, key, value=1):
+        with self._lock:
+            self._counters[name][key] += value
+
+    def latency_percentile(self, name, q):
+        with self._lock:
+            return percentile(list(self._latencies[name]), q)
+
+    def snapshot(self):
+        with self._lock:
+            names = set(self._latencies) | set(self._counters)
+            result = {}
+            for name in sorted(names):
+                latencies = list(self._latencies.get(name, ()))
+                entry = dict(self._counters.get(name, {}))
+                if latencies:
+                    entry["latency_ms"] = {
+                        "p50": percentile(latencies, 50),
+                        "p95": percentile(latencies, 95),
+                        "p99": percentile(latencies, 99),
+                        "max": max(latencies),
+                    }
+                result[name] = entry
+            return result
+
+
+# Shared registry for the whole process
+metrics = MetricsRegistry()
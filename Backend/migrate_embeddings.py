@@ -0,0 +1,284 @@
+"""
+Streaming re-chunk / re-embed migration for the Atlas `user_data` collection.
+
+New chunks are written next to the old ones under a version label: their
+vector lives in `embedding_<version>` and their metadata carries
+`index_version` plus `source_id` (the node id the ledger already knows), so
+the running app keeps serving the old vectors until cutover.
+
+    python migrate_embeddings.py migrate --version v2 --deployment text-embedding-3-small --chunk-size 512
+    python migrate_embeddings.py status --version v2
+    python migrate_embeddings.py cutover --version v2     # build the vector search index
+    # then set EMBEDDING_VERSION=v2 (plus the matching EMBEDDING_DEPLOYMENT and CHUNK_SIZE) and restart
+    python migrate_embeddings.py cleanup --version v2     # drop vectors from before v2
+
+Cutover is recorded in the version's checkpoint, and the app records the
+version it serves when it starts. Cleanup refuses to run until both show the
+app was restarted on the new version after cutover.
+
+Documents are streamed with a server-side cursor, a projection that leaves
+old embeddings on the server, and a fixed batch size. One batch is embedded
+with bounded concurrency and written with an ordered bulk_write before the
+next one is read, so memory stays constant. A checkpoint is saved after every
+batch, and an interrupted run resumes from it.
+
+Chunks are re-split from the stored nodes, not from whole pages, so a
+migration can make chunks smaller (or re-embed them at the same size) but
+never merge them: with a larger --chunk-size each new chunk is still at most
+one old chunk.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pymongo
+from dotenv import load_dotenv
+from pymongo import DeleteMany, ReplaceOne
+from pymongo.operations import SearchIndexModel
+
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
+
+from resilience import ResilientCaller
+
+DB_NAME = "user_data"
+COLLECTION_NAME = "user_data"
+CHECKPOINTS = "embedding_migrations"
+SERVING = "_serving"
+API_VERSION = "2023-07-01-preview"
+
+
+def embedding_field(version):
+    return f"embedding_{version}"
+
+
+def vector_index_name(version):
+    return f"vector_index_hacklytics_{version}"
+
+
+def source_filter(args):
+    """Documents of the version being replaced that do not carry the new vector yet."""
+    version = {"$exists": False} if args.source_version is None else args.source_version
+    return {"metadata.index_version": version, embedding_field(args.version): {"$exists": False}}
+
+
+def remaining_filter(args, checkpoint):
+    if checkpoint["last_id"] is None:
+        return source_filter(args)
+    return {**source_filter(args), "_id": {"$gt": checkpoint["last_id"]}}
+
+
+def ensure_indexes(collection):
+    """Upserts by id and ledger lookups by source_id must not scan the collection."""
+    collection.create_index("id")
+    collection.create_index("metadata.source_id")
+
+
+def load_checkpoint(database, version):
+    return database[CHECKPOINTS].find_one({"_id": version}) or {"_id": version, "last_id": None, "read": 0, "written": 0}
+
+
+def save_checkpoint(database, checkpoint):
+    checkpoint["updated_at"] = datetime.now(timezone.utc)
+    database[CHECKPOINTS].replace_one({"_id": checkpoint["_id"]}, checkpoint, upsert=True)
+
+
+def record_serving(database, version):
+    """Called by the app at startup with the EMBEDDING_VERSION it serves (None if unversioned)."""
+    database[CHECKPOINTS].replace_one(
+        {"_id": SERVING}, {"_id": SERVING, "version": version, "served_at": datetime.now(timezone.utc)}, upsert=True,
+    )
+
+
+# ============================================================================
+# migrate
+# ============================================================================
+
+def rechunk(doc, splitter, version):
+    """
+    Split one stored node into new-version nodes with deterministic ids.
+    Neighbouring nodes are never merged, so chunks can only get smaller.
+    """
+    node = metadata_dict_to_node(doc["metadata"], text=doc["text"])
+    source_id = doc["metadata"].get("source_id") or doc["id"]
+    chunks = splitter.get_nodes_from_documents([node])
+    for index, chunk in enumerate(chunks):
+        chunk.id_ = f"{source_id}-{version}-{index}"
+        chunk.metadata["source_id"] = source_id
+        chunk.metadata["index_version"] = version
+        chunk.excluded_embed_metadata_keys = list(node.excluded_embed_metadata_keys) + ["source_id", "index_version"]
+        chunk.excluded_llm_metadata_keys = list(node.excluded_llm_metadata_keys) + ["source_id", "index_version"]
+    return chunks
+
+
+def embed_all(nodes, embed_model, caller, embed_batch, concurrency):
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    batches = [texts[i:i + embed_batch] for i in range(0, len(texts), embed_batch)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = pool.map(lambda batch: caller.call(embed_model.get_text_embedding_batch, batch), batches)
+        return [vector for batch in results for vector in batch]
+
+
+def migrate(args, database):
+    collection = database[COLLECTION_NAME]
+    field = embedding_field(args.version)
+    splitter = SentenceSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    embed_model = AzureOpenAIEmbedding(
+        model=args.model or args.deployment,
+        deployment_name=args.deployment,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        azure_endpoint=os.getenv("AZURE_ENDPOINT"),
+        api_version=API_VERSION,
+        timeout=30,
+        max_retries=0,
+    )
+    caller = ResilientCaller("migration_embedding", deadline=120, max_attempts=5, min_hedge_delay=10.0)
+
+    checkpoint = load_checkpoint(database, args.version)
+    query = remaining_filter(args, checkpoint)
+    if checkpoint["last_id"] is not None:
+        print(f"Resuming after {checkpoint['last_id']} ({checkpoint['read']} read, {checkpoint['written']} written)")
+
+    cursor = collection.find(
+        query,
+        projection={"_id": 1, "id": 1, "text": 1, "metadata": 1},
+        sort=[("_id", pymongo.ASCENDING)],
+        batch_size=args.batch_size,
+        no_cursor_timeout=True,
+    )
+    started = time.monotonic()
+    try:
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= args.batch_size:
+                process_batch(batch, collection, field, splitter, embed_model, caller, args, database, checkpoint)
+                batch = []
+                if args.limit and checkpoint["read"] >= args.limit:
+                    break
+        if batch:
+            process_batch(batch, collection, field, splitter, embed_model, caller, args, database, checkpoint)
+    finally:
+        cursor.close()
+    print(f"Done: {checkpoint['read']} read, {checkpoint['written']} written in {time.monotonic() - started:.1f}s")
+
+
+def process_batch(batch, collection, field, splitter, embed_model, caller, args, database, checkpoint):
+    nodes = [chunk for doc in batch for chunk in rechunk(doc, splitter, args.version)]
+    vectors = embed_all(nodes, embed_model, caller, args.embed_batch, args.concurrency)
+    operations = [
+        ReplaceOne(
+            {"id": node.node_id},
+            {
+                "id": node.node_id,
+                "text": node.get_content(metadata_mode=MetadataMode.NONE),
+                field: vector,
+                "metadata": node_to_metadata_dict(node, remove_text=True, flat_metadata=False),
+            },
+            upsert=True,
+        )
+        for node, vector in zip(nodes, vectors)
+    ]
+    if operations:
+        collection.bulk_write(operations, ordered=True)
+
+    checkpoint["last_id"] = batch[-1]["_id"]
+    checkpoint["read"] += len(batch)
+    checkpoint["written"] += len(operations)
+    save_checkpoint(database, checkpoint)
+    print(f"{checkpoint['read']} read, {checkpoint['written']} written (last _id {checkpoint['last_id']})")
+
+
+# ============================================================================
+# status / cutover / cleanup
+# ============================================================================
+
+def status(args, database):
+    collection = database[COLLECTION_NAME]
+    checkpoint = load_checkpoint(database, args.version)
+    print(f"Checkpoint: {checkpoint['read']} read, {checkpoint['written']} written, last _id {checkpoint['last_id']}")
+    print(f"Source documents not yet migrated: {collection.count_documents(remaining_filter(args, checkpoint))}")
+    print(f"Documents with {embedding_field(args.version)}: "
+          f"{collection.count_documents({embedding_field(args.version): {'$exists': True}})}")
+
+
+def cutover(args, database):
+    """Create the vector search index over the new field. Serving switches via EMBEDDING_VERSION."""
+    collection = database[COLLECTION_NAME]
+    field = embedding_field(args.version)
+    sample = collection.find_one({field: {"$exists": True}}, {field: 1})
+    if not sample:
+        raise SystemExit(f"No documents carry {field}; run migrate first")
+
+    name = vector_index_name(args.version)
+    if not any(index["name"] == name for index in collection.list_search_indexes()):
+        collection.create_search_index(SearchIndexModel(
+            name=name,
+            type="vectorSearch",
+            definition={"fields": [
+                {"type": "vector", "path": field, "numDimensions": len(sample[field]), "similarity": "cosine"},
+                {"type": "filter", "path": "metadata.user_id"},
+                {"type": "filter", "path": "metadata.filename"},
+            ]},
+        ))
+        print(f"Created search index {name}; wait for it to become queryable")
+    checkpoint = load_checkpoint(database, args.version)
+    checkpoint["cutover_at"] = datetime.now(timezone.utc)
+    save_checkpoint(database, checkpoint)
+    print(f"Now set EMBEDDING_VERSION={args.version} with the matching EMBEDDING_DEPLOYMENT and CHUNK_SIZE, and restart")
+
+
+def cleanup(args, database):
+    """Delete the pre-migration documents once the app serves the new version."""
+    collection = database[COLLECTION_NAME]
+    checkpoint = load_checkpoint(database, args.version)
+    if "cutover_at" not in checkpoint:
+        raise SystemExit(f"{args.version} has not been cut over; run cutover first")
+    # Not covered by --force: deleting the vectors the app still reads breaks chat.
+    serving = database[CHECKPOINTS].find_one({"_id": SERVING}) or {}
+    if serving.get("version") != args.version or serving["served_at"] < checkpoint["cutover_at"]:
+        raise SystemExit(f"The app serves {serving.get('version') or 'the unversioned index'}, not {args.version}; "
+                         f"set EMBEDDING_VERSION={args.version} and restart it before cleanup")
+    remaining = collection.count_documents(remaining_filter(args, checkpoint))
+    if remaining and not args.force:
+        raise SystemExit(f"{remaining} source documents have not been migrated; rerun migrate or pass --force")
+    # Documents written since cutover carry the new field and never match.
+    query = source_filter(args)
+    result = collection.bulk_write([DeleteMany(query)], ordered=True)
+    print(f"Deleted {result.deleted_count} documents")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command in ("migrate", "status", "cutover", "cleanup"):
+        sub = subparsers.add_parser(command)
+        sub.add_argument("--version", required=True, help="label for the new index version, e.g. v2")
+        sub.add_argument("--source-version", default=None, help="version being replaced (default: unversioned)")
+        if command == "migrate":
+            sub.add_argument("--deployment", default="text-embedding-ada-002")
+            sub.add_argument("--model", default=None, help="model name if it differs from the deployment")
+            sub.add_argument("--chunk-size", type=int, default=1024,
+                             help="new chunk size; no larger than the current one (chunks are never merged)")
+            sub.add_argument("--chunk-overlap", type=int, default=10)
+            sub.add_argument("--batch-size", type=int, default=256, help="documents per cursor batch and write")
+            sub.add_argument("--embed-batch", type=int, default=64, help="texts per embedding request")
+            sub.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight")
+            sub.add_argument("--limit", type=int, default=0, help="stop after this many documents (0 = all)")
+        if command == "cleanup":
+            sub.add_argument("--force", action="store_true")
+
+    args = parser.parse_args()
+    database = pymongo.MongoClient(os.getenv("ATLAS_CONNECTION_STRING"))[DB_NAME]
+    ensure_indexes(database[COLLECTION_NAME])
+    {"migrate": migrate, "status": status, "cutover": cutover, "cleanup": cleanup}[args.command](args, database)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Nightly batch precompute for insights and suggested-question answers.
+
+Walks ingested statements (by default only those not precomputed yet, i.e.
+ingested since the last run; `--all` redoes every statement), computes the
+insights JSON and the answers to the questions the chat prompt advertises,
+and stores them for /api/insights and /api/chat to serve. It then forecasts
+every user with rollups in batches (no LLM calls) for /api/forecast.
+
+The job runs inside the web app, so its LLM calls are admitted by the app's
+scheduler as batch work under their own tenant (TENANT) and chat keeps its
+reserved workers. This script only triggers it through /api/precompute:
+
+    python precompute.py
+    python precompute.py --all --concurrency 8
+
+It needs PRECOMPUTE_TOKEN (the same value the app is started with) and
+PRECOMPUTE_URL if the app does not listen on localhost:8080. The tenant's
+concurrency is capped by the app's PRECOMPUTE_CONCURRENCY.
+
+Statements are processed through a bounded pool. Each one's index is rebuilt
+from stored embeddings and released when it is done.
+"""
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from dotenv import load_dotenv
+
+from forecasting import DEFAULT_HORIZON, forecast_users
+from prompts import SUGGESTED_QUESTIONS
+from scheduler import BATCH
+
+JOB_NAME = "precompute"
+TENANT = "precompute"
+FORECAST_BATCH = 500
+
+_running = threading.Lock()
+
+
+def precompute_statement(app, statement):
+    pdf_id = statement["pdf_id"]
+    vector_index = app.get_statement_index(pdf_id, cache=False)
+    if vector_index is None:
+        return False
+
+    insights = app.compute_insights(vector_index, TENANT)
+    if insights:
+        app.precomputed.save_insights(pdf_id, insights)
+    for question in SUGGESTED_QUESTIONS:
+        answer = app.answer_question(pdf_id, vector_index, question, [], TENANT, priority=BATCH)
+        app.precomputed.save_answer(pdf_id, question, answer)
+
+    app.statement_ledger.annotate(pdf_id, precomputed_at=datetime.now(timezone.utc))
+    return True
+
+
+def precompute_forecasts(app, horizon=DEFAULT_HORIZON):
+    """Forecast every user, FORECAST_BATCH users per vectorized fit."""
+    user_ids = app.user_rollups.user_ids()
+    for offset in range(0, len(user_ids), FORECAST_BATCH):
+        series_by_user = {
+            user_id: app.user_rollups.monthly_series(user_id, max(app.DASHBOARD_MONTHS))
+            for user_id in user_ids[offset:offset + FORECAST_BATCH]
+        }
+        app.precomputed.save_forecasts(forecast_users(series_by_user, horizon), horizon)
+    return len(user_ids)
+
+
+def run(app, all_statements=False, concurrency=4):
+    """Precompute statements using the components of the running app module."""
+    started_at = datetime.now(timezone.utc)
+    started = time.monotonic()
+    query = {} if all_statements else {"precomputed_at": {"$exists": False}}
+    cursor = app.statement_ledger.statements.find(query, {"_id": 0, "pdf_id": 1, "user_id": 1}, batch_size=100)
+
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    lock = threading.Lock()
+    # Bound in-flight statements so the cursor is not drained into memory.
+    slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def work(statement):
+        try:
+            outcome = "done" if precompute_statement(app, statement) else "skipped"
+        except Exception as e:
+            print(f"Failed to precompute {statement['pdf_id']}: {str(e)}")
+            outcome = "failed"
+        finally:
+            slots.release()
+        with lock:
+            counts[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for statement in cursor:
+            slots.acquire()
+            pool.submit(work, statement)
+
+    counts["forecasts"] = precompute_forecasts(app)
+    app.precomputed.record_run(JOB_NAME, started_at, **counts)
+    print(f"Precomputed {counts['done']} statements ({counts['skipped']} skipped, {counts['failed']} failed) "
+          f"and {counts['forecasts']} forecasts in {time.monotonic() - started:.1f}s")
+    return counts
+
+
+def start(app, all_statements=False, concurrency=4):
+    """Run the job on a background thread; False if a run is already in progress."""
+    if not _running.acquire(blocking=False):
+        return False
+
+    def target():
+        try:
+            run(app, all_statements=all_statements, concurrency=concurrency)
+        finally:
+            _running.release()
+
+    threading.Thread(target=target, name=JOB_NAME, daemon=True).start()
+    return True
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--all", action="store_true", help="recompute every statement, not just new ones")
+    parser.add_argument("--concurrency", type=int, default=4, help="statements processed in parallel")
+    parser.add_argument("--url", default=os.getenv("PRECOMPUTE_URL", "http://localhost:8080"),
+                        help="base URL of the running app")
+    args = parser.parse_args()
+    response = requests.post(
+        f"{args.url.rstrip('/')}/api/precompute",
+        json={"all": args.all, "concurrency": args.concurrency},
+        headers={"X-Precompute-Token": os.getenv("PRECOMPUTE_TOKEN", "")},
+        timeout=30,
+    )
+    print(response.status_code, response.json())
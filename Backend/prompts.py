@@ -0,0 +1,276 @@
+"""
+Prompt assembly with token accounting.
+
+Static instructions are kept as a fixed system prefix, byte-identical across
+requests, so provider-side prefix caching can reuse them. Variable sections
+(retrieved context, chat history, the question) follow it and are trimmed to
+token budgets counted with a local tokenizer.
+"""
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import tiktoken
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.prompts import ChatPromptTemplate
+from llama_index.core.schema import MetadataMode
+
+TOKENIZER_MODEL = "gpt-4o"
+
+# ============================================================================
+# Static prompt prefixes
+# ============================================================================
+
+CHAT_SYSTEM_PROMPT = """\
+You are an AI assistant helping users analyze their bank statements. The user has uploaded a PDF containing their financial transactions in their bank statement.
+Your role is to provide clear, concise, and insightful answers based on the document.
+Context:
+- The PDF contains financial transactions, including income, expenses, and other financial activities.
+- Transactions may include merchant names, dates, amounts, and categories.
+- The user may ask about their spending habits, category-wise breakdowns, unusual transactions, trends, and budget insights.
+- Ensure responses are factual, analytical, and directly based on the provided data.
+The user can ask questions such as :
+- "What was my total expenditure last month?"
+- "Break down my expenses into categories."
+- "Find unusual or large transactions."
+- "Compare my spending between two months."
+- "Identify my top 5 spending categories."
+- If a question requires comparisons, ensure that you summarize the trend based on available data.
+Response Guidelines:
+1. Be Data-Driven - Ensure that answers are only based on the bank statement data.
+2. Be Concise & Structured - If applicable, provide information in bullets or tables.
+3. Ensure Clarity - Avoid ambiguity and respond in simple, easy-to-understand language.
+4. Highlight Trends & Insights - If patterns exist in spending, mention them.
+MAKE SURE YOU PROPERLY READ THE DOCUMENT AND UNDERSTAND ALL OF THE INFORMATION.
+DO NOT HALLUCINATE OR PROVIDE FALSE INFORMATION. IF THE DATA IS NOT AVAILABLE, STATE THAT THE INFORMATION IS NOT IN THE DOCUMENT.
+YOU SHOULD SEND THE RESPONSE AS A PLAIN HTML STRING and MAKE SURE YOU INCLUDE ALL THE HTML INSIDE A <div> </div> use any headers of h3 size and lower like h4 etc. DO NOT INCLUDE ANY EXPLANATIONS OR EXTRA TEXT OUTSIDE HTML.
+"""
+
+# The example questions advertised in CHAT_SYSTEM_PROMPT; their answers are
+# precomputed per statement by precompute.py.
+SUGGESTED_QUESTIONS = (
+    "What was my total expenditure last month?",
+    "Break down my expenses into categories.",
+    "Find unusual or large transactions.",
+    "Compare my spending between two months.",
+    "Identify my top 5 spending categories.",
+)
+
+CHAT_RESPONSE_FORMAT = (
+    "Please provide your response in plain HTML format only inside <div> </div> and since we are displaying "
+    "this on chatbot, use any headers of h3 size and lower like h4 etc. Do not include any explanations or "
+    "extra text outside HTML."
+)
+
+INSIGHTS_SYSTEM_PROMPT = """\
+You are an expert financial analyst.
+Given the bank statement text below, extract and compute the following insights strictly in valid JSON format without any additional commentary, explanations, or extra text.
+Chart Data Format:
+Include chart data in the following format:
+The first line chart should include 12 entries, one for each month of the year.
+Each entry should have three keys: "name" (the month name), "Income" (the total income for that month), and "Expenditure" (the total expenditure for that month).
+The second bar chart should include 5 entries, where you give the top 5 categories that have the most expenses.
+Each entry should have two keys: "name" (the category name) and "amount" (the total amount spent in that particular category).
+The third pie chart should take all the expenses and then accumulate them into categories.
+Each entry should have two keys: "name" (the category name) and "amount" (the total amount spent in that particular category).
+Try and put similar categories together and then provide the total amount spent in each category.
+The fourth line chart will have the savings for each month. Essentially this will just be the difference between the income and the expenditure for each month that you calculated in the first line chart.
+Each entry should have three keys: "name" (the month name), "amount" (income-expenditure for that month).
+Analyze all of the data and then find the common categories and accumulate them.
+```json
+{
+"charts": {
+    "lineChart": {
+    "data": [
+        { "name": "January", "Income": 4000, "Expenditure": 2400 },
+        { "name": "February", "Income": 3000, "Expenditure": 1398 },
+        { "name": "March", "Income": 2000, "Expenditure": 9800 },
+        { "name": "April", "Income": 5000, "Expenditure": 3100 },
+        { "name": "May", "Income": 7000, "Expenditure": 4500 },
+        { "name": "June", "Income": 6500, "Expenditure": 4000 },
+        { "name": "July", "Income": 8000, "Expenditure": 5000 },
+        { "name": "August", "Income": 7200, "Expenditure": 4600 },
+        { "name": "September", "Income": 6800, "Expenditure": 4400 },
+        { "name": "October", "Income": 7500, "Expenditure": 4800 },
+        { "name": "November", "Income": 7800, "Expenditure": 5100 },
+        { "name": "December", "Income": 8200, "Expenditure": 5300 }
+    ]
+    },
+    "barChart": {
+    "data": [
+        { "name": "Rent", "amount": 1500 },
+        { "name": "Groceries", "amount": 800 },
+        { "name": "Transport", "amount": 600 },
+        { "name": "Entertainment", "amount": 400 },
+        { "name": "Utilities", "amount": 300 }
+    ]
+    },
+    "pieChart": {
+    "data": [
+        { "name": "Rent", "amount": 1500 },
+        { "name": "Groceries", "amount": 800 },
+        { "name": "Transport", "amount": 600 },
+        { "name": "Entertainment", "amount": 400 },
+        { "name": "Utilities", "amount": 300 }
+    ]
+    },
+    "savingsChart": {
+        "data": [
+        { "name": "January", "amount": 2400 },
+        { "name": "February", "amount": 1398 },
+        { "name": "March", "amount": 9800 },
+        { "name": "April", "amount": 3100 },
+        { "name": "May", "amount": 4500 },
+        { "name": "June", "amount": 4000 },
+        { "name": "July", "amount": 5000 },
+        { "name": "August", "amount": 4600 },
+        { "name": "September", "amount": 4400 },
+        { "name": "October", "amount": 4800 },
+        { "name": "November", "amount": 5100 },
+        { "name": "December", "amount": 5300 }
+    ]
+    }
+}
+}
+Your JSON must include the three charts with the specified data format.
+Do not include any additional text or explanations before or after the JSON.
+Return only valid JSON.
+"""
+
+SUMMARY_SYSTEM_PROMPT = """\
+You are an expert financial analyst summarizing a bank statement for later question answering.
+Write a compact, factual plain-text summary of the material you are given.
+Keep every figure exact: totals, balances, dates, merchants and amounts. Never estimate or invent numbers.
+Mention income sources, the largest expenses, recurring payments and anything unusual.
+Do not use HTML or markdown headings.
+"""
+
+SUMMARY_ANSWER_BODY = (
+    "Precomputed summaries of the bank statement are below, from the whole statement down to each month.\n"
+    "---------------------\n"
+    "{summaries}\n"
+    "---------------------\n"
+    "{query}"
+)
+
+# ============================================================================
+# Token counting
+# ============================================================================
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+
+
+def count_tokens(text):
+    return len(_encoding().encode(text)) if text else 0
+
+
+def truncate_tokens(text, budget):
+    """Cut `text` to at most `budget` tokens. Returns (text, token count)."""
+    tokens = _encoding().encode(text)
+    if len(tokens) <= budget:
+        return text, len(tokens)
+    return _encoding().decode(tokens[:budget]), budget
+
+
+# ============================================================================
+# Compiler
+# ============================================================================
+
+@dataclass
+class CompiledPrompt:
+    """A static system prefix plus the variable user section, with token counts per section."""
+    system: str
+    user: str
+    sections: dict = field(default_factory=dict)
+
+    @property
+    def total_tokens(self):
+        return sum(self.sections.values())
+
+    def messages(self):
+        return [
+            ChatMessage(role=MessageRole.SYSTEM, content=self.system),
+            ChatMessage(role=MessageRole.USER, content=self.user),
+        ]
+
+
+class PromptCompiler:
+    """Builds prompts from a fixed system prefix and budgeted variable sections."""
+    def __init__(self, system, suffix="", context_budget=6000, history_budget=1500):
+        self.system = system
+        self.suffix = suffix
+        self.context_budget = context_budget
+        self.history_budget = history_budget
+        self._system_tokens = count_tokens(system)
+        self._suffix_tokens = count_tokens(suffix)
+
+    def compile(self, question="", history=(), context="", context_header=""):
+        """
+        Assemble the user section as context, history, question, suffix.
+        Context is cut at the tail to its budget; history keeps the most recent
+        (question, answer) turns that fit.
+        """
+        sections = {"system": self._system_tokens}
+        parts = []
+        if context:
+            context, sections["context"] = truncate_tokens(context, self.context_budget)
+            parts.append(f"{context_header}\n{context}" if context_header else context)
+        if history:
+            turns, used = [], 0
+            for asked, answered in reversed(history):
+                turn = f"Q: {asked}\nA: {answered}"
+                cost = count_tokens(turn)
+                if used + cost > self.history_budget:
+                    break
+                turns.append(turn)
+                used += cost
+            if turns:
+                parts.append("Chat history till now:\n" + "\n".join(reversed(turns)))
+                sections["history"] = used
+        if question:
+            parts.append(f"Current Question that the user is asking Q: {question}")
+            sections["question"] = count_tokens(question)
+        if self.suffix:
+            parts.append(self.suffix)
+            sections["suffix"] = self._suffix_tokens
+        return CompiledPrompt(system=self.system, user="\n\n".join(parts), sections=sections)
+
+    def query_template(self, body):
+        """
+        A llama-index chat template whose first message is the static system
+        prefix, for query engines that insert retrieved context themselves.
+        """
+        return ChatPromptTemplate(message_templates=[
+            ChatMessage(role=MessageRole.SYSTEM, content=_escape_braces(self.system)),
+            ChatMessage(role=MessageRole.USER, content=body),
+        ])
+
+
+def _escape_braces(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class TokenBudgetPostprocessor(BaseNodePostprocessor):
+    """Keeps the highest-ranked retrieved nodes that fit within a token budget."""
+    max_tokens: int = 6000
+
+    @classmethod
+    def class_name(cls):
+        return "TokenBudgetPostprocessor"
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        kept, used = [], 0
+        for node in nodes:
+            cost = count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            if used + cost > self.max_tokens:
+                break
+            kept.append(node)
+            used += cost
+        return kept
+
+
+def context_tokens(source_nodes):
+    """Token count of the context a query engine actually used."""
+    return sum(count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM)) for node in source_nodes)
@@ -0,0 +1,215 @@
+"""
+Tail-latency control for calls to Azure OpenAI.
+
+A ResilientCaller wraps one dependency (the LLM or the embedding model) with
+a per-call deadline, bounded retries with full jitter, a hedged duplicate
+request once an attempt runs past the observed p95, and a circuit breaker
+that fails fast while the dependency is down.
+
+Only transient errors (timeouts, throttling, server errors, dropped
+connections) are retried and count against the breaker. Anything else, such
+as a rejected request or a parse error in the caller's own code, would fail
+the same way again and says nothing about the dependency's health, so it is
+raised straight away.
+"""
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from openai import APIConnectionError
+
+from metrics import metrics
+
+TRANSIENT_STATUS_CODES = (408, 429)
+
+
+def is_transient(error):
+    """Whether `error` is worth retrying: a timeout, 408/429, a 5xx or a connection failure."""
+    if isinstance(error, (TimeoutError, ConnectionError, APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in TRANSIENT_STATUS_CODES or status >= 500)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the dependency while its circuit breaker is open."""
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is temporarily unavailable")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call (including retries and hedges) runs past its deadline."""
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one trial call through after a cool-down."""
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def release(self):
+        """End a trial call without a verdict on the dependency's health."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Returns True if this failure opened (or re-opened) the circuit."""
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class ResilientCaller:
+    """Deadlines, jittered retries, hedging and circuit breaking around one dependency."""
+    def __init__(
+        self,
+        name,
+        deadline=60.0,
+        max_attempts=3,
+        base_backoff=0.5,
+        hedge_percentile=95,
+        min_hedge_delay=2.0,
+        max_workers=32,
+        hedge=True,
+        breaker=None,
+    ):
+        self.name = name
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    def call(self, fn, *args, deadline=None, hedge=None, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` under this caller's policies and return its
+        result. `hedge` overrides the caller's default for this call. Raises CircuitOpenError, DeadlineExceeded, the first
+        non-transient error or the last transient one.
+        """
+        if not self.breaker.allow():
+            metrics.increment(self.name, "rejected")
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+
+        if hedge is None:
+            hedge = self.hedge
+        started = time.monotonic()
+        deadline_at = started + (deadline or self.deadline)
+        last_error = None
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                result = self._attempt(fn, args, kwargs, remaining, hedge)
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.release()
+                    metrics.record(self.name, (time.monotonic() - started) * 1000, errors=1)
+                    raise
+                last_error = e
+                metrics.increment(self.name, "failures")
+                if self.breaker.record_failure():
+                    metrics.increment(self.name, "circuit_opened")
+                    break
+                if attempt < self.max_attempts:
+                    # Full jitter keeps retries from a burst of failures from re-synchronising.
+                    backoff = random.uniform(0, self.base_backoff * 2 ** (attempt - 1))
+                    time.sleep(min(backoff, max(0.0, deadline_at - time.monotonic())))
+                continue
+
+            self.breaker.record_success()
+            metrics.record(self.name, (time.monotonic() - started) * 1000, attempts=attempt)
+            return result
+
+        metrics.record(self.name, (time.monotonic() - started) * 1000, errors=1)
+        if isinstance(last_error, DeadlineExceeded) or last_error is None:
+            raise DeadlineExceeded(f"{self.name} call exceeded its {deadline or self.deadline:g}s deadline")
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.name, self.breaker.retry_after()) from last_error
+        raise last_error
+
+    def _hedge_delay(self):
+        observed = metrics.latency_percentile(self.name, self.hedge_percentile)
+        return max(self.min_hedge_delay, (observed or 0) / 1000)
+
+    def _attempt(self, fn, args, kwargs, remaining, hedge):
+        attempt_started = time.monotonic()
+        pending = {self._pool.submit(fn, *args, **kwargs)}
+
+        hedge_delay = self._hedge_delay()
+        if hedge and remaining > hedge_delay:
+            done, pending = wait(pending, timeout=hedge_delay)
+            if done:
+                return done.pop().result()
+            pending.add(self._pool.submit(fn, *args, **kwargs))
+            metrics.increment(self.name, "hedges")
+
+        # First successful completion wins; a failed copy only counts once all copies fail.
+        error = None
+        while pending:
+            timeout = remaining - (time.monotonic() - attempt_started)
+            if timeout <= 0:
+                break
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"{self.name} attempt timed out")
+
+    def status(self):
+        return {"state": self.breaker.state, "retry_after": round(self.breaker.retry_after(), 1)}
@@ -0,0 +1,141 @@
+"""
+Per-user monthly rollups.
+
+After each upload the months a statement covers are recomputed from the
+ledger's de-duplicated transactions into one document per user and month.
+Recomputing (rather than incrementing) makes a retried upload repair a month
+whose earlier write failed instead of skipping or double counting it. The
+multi-month dashboard is then assembled from at most 24 small documents,
+however many statements or transactions sit behind them.
+"""
+import calendar
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import pymongo
+from pymongo import DeleteOne, ReplaceOne
+
+DASHBOARD_MONTHS = (12, 24)
+
+
+def month_label(month):
+    """'2023-04' -> 'April 2023'."""
+    year, number = month.split("-")
+    return f"{calendar.month_name[int(number)]} {year}"
+
+
+def month_window(last_month, months):
+    """The `months` consecutive 'YYYY-MM' keys ending at `last_month`."""
+    year, number = (int(part) for part in last_month.split("-"))
+    index = year * 12 + number - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(index - months + 1, index + 1)]
+
+
+class UserRollupStore:
+    """Monthly aggregates (income, expenditure, categories) per user."""
+    def __init__(self, database):
+        self.collection = database["user_rollups"]
+        self.collection.create_index(
+            [("user_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+            unique=True,
+        )
+
+    def replace_months(self, user_id, months, transactions):
+        """
+        Recompute the month documents for `months` from `transactions`, which
+        must be all of the user's transactions in those months.
+        """
+        totals = {month: {"transactions": 0, "income": 0.0, "expenditure": 0.0, "categories": defaultdict(float)}
+                  for month in months}
+        for txn in transactions:
+            if txn.month not in totals:
+                continue
+            month = totals[txn.month]
+            month["transactions"] += 1
+            if txn.amount >= 0:
+                month["income"] += txn.amount
+            else:
+                month["expenditure"] += -txn.amount
+                month["categories"][txn.category.replace(".", "_")] += -txn.amount
+
+        operations = []
+        now = datetime.now(timezone.utc)
+        for month, doc in totals.items():
+            key = {"user_id": user_id, "month": month}
+            if doc["transactions"]:
+                doc["categories"] = dict(doc["categories"])
+                operations.append(ReplaceOne(key, {**key, **doc, "updated_at": now}, upsert=True))
+            else:
+                operations.append(DeleteOne(key))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def user_ids(self):
+        return self.collection.distinct("user_id")
+
+    def last_updated(self, user_id):
+        """When any of the user's month documents last changed, or None."""
+        latest = self.collection.find_one(
+            {"user_id": user_id}, {"updated_at": 1}, sort=[("updated_at", pymongo.DESCENDING)]
+        )
+        return latest.get("updated_at") if latest else None
+
+    def monthly_series(self, user_id, months=12):
+        """
+        Zero-filled rollups for the `months` months ending at the user's latest
+        month with data, oldest first. Returns [] if the user has no data.
+        `observed` is False for months no statement covered, so consumers can
+        tell a gap in the uploads from a month with no activity.
+        """
+        latest = self.collection.find_one({"user_id": user_id}, {"month": 1}, sort=[("month", pymongo.DESCENDING)])
+        if not latest:
+            return []
+        window = month_window(latest["month"], months)
+        found = {
+            doc["month"]: doc
+            for doc in self.collection.find(
+                {"user_id": user_id, "month": {"$gte": window[0], "$lte": window[-1]}},
+                {"_id": 0, "user_id": 0},
+            )
+        }
+        series = []
+        for month in window:
+            doc = found.get(month, {})
+            income = round(doc.get("income", 0.0), 2)
+            expenditure = round(doc.get("expenditure", 0.0), 2)
+            series.append({
+                "month": month,
+                "observed": month in found,
+                "income": income,
+                "expenditure": expenditure,
+                "savings": round(income - expenditure, 2),
+                "categories": doc.get("categories", {}),
+            })
+        return series
+
+    def dashboard(self, user_id, months=12):
+        """Chart payload in the same shape `/api/insights` returns for one statement."""
+        series = self.monthly_series(user_id, months)
+        category_totals = defaultdict(float)
+        for entry in series:
+            for category, amount in entry["categories"].items():
+                category_totals[category] += amount
+        categories = sorted(
+            ({"name": name, "amount": round(amount, 2)} for name, amount in category_totals.items()),
+            key=lambda item: item["amount"],
+            reverse=True,
+        )
+        return {
+            "charts": {
+                "lineChart": {"data": [
+                    {"name": month_label(e["month"]), "Income": e["income"], "Expenditure": e["expenditure"]}
+                    for e in series
+                ]},
+                "barChart": {"data": categories[:5]},
+                "pieChart": {"data": categories},
+                "savingsChart": {"data": [
+                    {"name": month_label(e["month"]), "amount": e["savings"]} for e in series
+                ]},
+            }
+        }
@@ -0,0 +1,168 @@
+"""
+Central scheduler for LLM work.
+
+Every LLM-bound job goes through one bounded worker pool:
+
+- Priority classes: interactive chat is always dispatched before batch work
+  (ingestion, insights), and a few workers are reserved for it, so a burst of
+  uploads can never occupy the whole pool.
+- Per-user quotas: a user has at most `per_user_limit` jobs of each class
+  running at once, so a user's uploads never hold back their own chat.
+  `limits` overrides the quota for specific tenants (e.g. the precompute job).
+- Weighted fair queuing: within a class, jobs are ordered by virtual finish
+  time (start + cost / weight), so a tenant with a deep backlog shares the
+  pool with everyone else instead of draining it first.
+
+Under overload batch jobs simply wait longer; interactive jobs that cannot
+start within `max_wait` fail fast with SchedulerOverloaded.
+"""
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import metrics
+
+INTERACTIVE, BATCH = 0, 1
+CLASS_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a job waited longer than its class allows before starting."""
+
+
+class _Job:
+    __slots__ = ("user_id", "priority", "fn", "args", "kwargs", "tag", "future", "enqueued", "deadline")
+
+    def __init__(self, user_id, priority, fn, args, kwargs, tag, max_wait):
+        self.user_id = user_id
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.tag = tag
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.deadline = self.enqueued + max_wait if max_wait else None
+
+
+class LLMScheduler:
+    """Priority classes, per-user concurrency quotas and weighted fair queuing over one worker pool."""
+    def __init__(self, workers=8, reserved_interactive=2, per_user_limit=2, max_wait=None, weights=None,
+                 limits=None):
+        self.workers = workers
+        self.reserved_interactive = reserved_interactive
+        self.per_user_limit = per_user_limit
+        self.max_wait = max_wait or {INTERACTIVE: 30.0, BATCH: None}
+        self.weights = weights or {}
+        self.limits = limits or {}
+
+        self._lock = threading.Condition()
+        self._queues = {cls: defaultdict(deque) for cls in CLASS_NAMES}   # class -> user -> jobs
+        self._virtual_time = {cls: 0.0 for cls in CLASS_NAMES}
+        self._last_finish = {cls: defaultdict(float) for cls in CLASS_NAMES}
+        self._running = {cls: 0 for cls in CLASS_NAMES}
+        self._running_by_user = defaultdict(int)   # (class, user) -> running jobs
+        self._sequence = itertools.count()
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-worker")
+        threading.Thread(target=self._dispatch_loop, name="llm-dispatcher", daemon=True).start()
+
+    def submit(self, user_id, priority, fn, *args, cost=1.0, **kwargs):
+        """Queue `fn(*args, **kwargs)` for `user_id`; returns a Future."""
+        with self._lock:
+            weight = self.weights.get(user_id, 1.0)
+            start = max(self._virtual_time[priority], self._last_finish[priority][user_id])
+            finish = start + cost / weight
+            self._last_finish[priority][user_id] = finish
+            job = _Job(user_id, priority, fn, args, kwargs, (finish, next(self._sequence)), self.max_wait[priority])
+            self._queues[priority][user_id].append(job)
+            self._lock.notify()
+        return job.future
+
+    def run(self, user_id, priority, fn, *args, cost=1.0, **kwargs):
+        """Submit and wait for the result."""
+        return self.submit(user_id, priority, fn, *args, cost=cost, **kwargs).result()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for cls, name in CLASS_NAMES.items():
+                queued = [job for jobs in self._queues[cls].values() for job in jobs]
+                result[name] = {
+                    "queued": len(queued),
+                    "running": self._running[cls],
+                    "users_waiting": sum(1 for jobs in self._queues[cls].values() if jobs),
+                    "oldest_wait_ms": round(max((now - job.enqueued for job in queued), default=0) * 1000, 1),
+                }
+            result["workers"] = self.workers
+            return result
+
+    # ------------------------------------------------------------------------
+
+    def _capacity(self, cls):
+        busy = sum(self._running.values())
+        if busy >= self.workers:
+            return False
+        if cls == BATCH:
+            return self._running[BATCH] < self.workers - self.reserved_interactive
+        return True
+
+    def _next_job(self):
+        """Pick the eligible job with the smallest finish tag, highest class first."""
+        now = time.monotonic()
+        for cls in sorted(CLASS_NAMES):
+            queues = self._queues[cls]
+            # Drop jobs that waited too long, failing them instead of running late.
+            for jobs in queues.values():
+                while jobs and jobs[0].deadline is not None and jobs[0].deadline < now:
+                    expired = jobs.popleft()
+                    metrics.increment(f"queue_{CLASS_NAMES[cls]}", "rejected")
+                    expired.future.set_exception(SchedulerOverloaded(
+                        f"LLM capacity exhausted; {CLASS_NAMES[cls]} request waited too long"
+                    ))
+            if not self._capacity(cls):
+                continue
+            candidates = [
+                jobs[0] for user_id, jobs in queues.items()
+                if jobs and self._running_by_user[(cls, user_id)] < self.limits.get(user_id, self.per_user_limit)
+            ]
+            if candidates:
+                job = min(candidates, key=lambda candidate: candidate.tag)
+                queues[job.user_id].popleft()
+                if not queues[job.user_id]:
+                    del queues[job.user_id]
+                self._virtual_time[cls] = job.tag[0]
+                return job
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    # Wake periodically so queued interactive jobs can expire.
+                    self._lock.wait(timeout=1.0)
+                    job = self._next_job()
+                self._running[job.priority] += 1
+                self._running_by_user[(job.priority, job.user_id)] += 1
+            metrics.record(f"queue_{CLASS_NAMES[job.priority]}", (time.monotonic() - job.enqueued) * 1000)
+            self._pool.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as e:
+                    job.future.set_exception(e)
+        finally:
+            with self._lock:
+                self._running[job.priority] -= 1
+                key = (job.priority, job.user_id)
+                self._running_by_user[key] -= 1
+                if not self._running_by_user[key]:
+                    del self._running_by_user[key]
+                self._lock.notify()
@@ -0,0 +1,178 @@
+"""
+Structured parsing of bank statement text.
+
+The PDF reader hands us one Document per page. These helpers pull the account
+number and the individual transaction rows out of that text so ingestion can
+tell which parts of an upload have already been indexed.
+"""
+import re
+import hashlib
+from collections import Counter
+from dataclasses import dataclass
+
+# ============================================================================
+# Patterns
+# ============================================================================
+
+AMOUNT = r"\$\s?[\d,]+(?:\.\d{1,2})?"
+
+ACCOUNT_PATTERN = re.compile(
+    r"Account\s+(?:Number|No\.?)\s*:\s*([0-9Xx*][0-9Xx*\-]*[0-9Xx*])",
+    re.IGNORECASE,
+)
+
+# A row is "MM/DD/YYYY <description> <withdrawal|-> <deposit|-> <balance>".
+# Empty columns are either blank or a lone "-", so the amounts group accepts
+# one to three dollar values with optional dash placeholders between them.
+ROW_PATTERN = re.compile(
+    r"(?P<date>\d{2}/\d{2}/\d{4})\s+"
+    r"(?P<description>(?:(?!\d{2}/\d{2}/\d{4})[^$])+?)\s+"
+    rf"(?P<amounts>(?:-\s+)?{AMOUNT}(?:\s+(?:-\s+)?{AMOUNT}){{0,2}})"
+)
+
+AMOUNT_TOKEN = re.compile(rf"-|{AMOUNT}")
+
+CREDIT_KEYWORDS = ("deposit", "salary", "payroll", "refund", "interest", "credit")
+
+CATEGORY_KEYWORDS = (
+    ("Income", ("salary", "payroll", "direct deposit", "interest", "refund")),
+    ("Rent", ("rent", "mortgage")),
+    ("Groceries", ("grocery", "supermarket")),
+    ("Utilities", ("electric", "water bill", "gas bill", "internet", "phone", "utility")),
+    ("Dining", ("dining", "restaurant", "coffee", "cafe")),
+    ("Transport", ("transport", "fuel", "uber", "lyft", "taxi", "parking")),
+    ("Healthcare", ("health", "doctor", "pharmacy", "hospital")),
+    ("Entertainment", ("entertainment", "movie", "netflix", "spotify", "getaway", "travel")),
+    ("Fitness", ("gym", "fitness")),
+    ("Investments", ("investment", "mutual fund", "brokerage")),
+    ("Shopping", ("shopping", "amazon", "clothes", "store")),
+)
+
+# ============================================================================
+# Parsing
+# ============================================================================
+
+@dataclass(frozen=True)
+class Transaction:
+    """A single parsed statement row. Debits carry a negative amount."""
+    date: str
+    description: str
+    amount: float
+    balance: float
+    category: str
+    fingerprint: str
+    span: tuple
+
+    @property
+    def month(self):
+        return self.date[:7]
+
+
+def normalize_text(text):
+    """Collapse all whitespace so rows split across lines parse the same way."""
+    return " ".join(text.split())
+
+
+def page_fingerprint(text):
+    """Stable hash of a page's content, insensitive to whitespace and case."""
+    return hashlib.sha1(normalize_text(text).lower().encode("utf-8")).hexdigest()
+
+
+def detect_account(text):
+    """Return the account number printed on the statement, or None."""
+    match = ACCOUNT_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+def categorize(description, amount):
+    lowered = description.lower()
+    for category, keywords in CATEGORY_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return category
+    return "Income" if amount > 0 else "Other"
+
+
+def _to_float(token):
+    return float(token.replace("$", "").replace(",", "").strip())
+
+
+def parse_pages(page_texts):
+    """
+    Parse transaction rows from every page of a statement, in order.
+
+    Returns one list of Transaction per page. Fingerprints include an
+    occurrence counter so two identical purchases on the same day stay
+    distinct, while the same row seen in another export hashes the same.
+    """
+    occurrences = Counter()
+    previous_balance = None
+    pages = []
+    for text in page_texts:
+        rows = []
+        for match in ROW_PATTERN.finditer(normalize_text(text)):
+            tokens = AMOUNT_TOKEN.findall(match.group("amounts"))
+            values = [_to_float(token) for token in tokens if token != "-"]
+            balance = values[-1]
+            if len(values) == 1:
+                # Opening/closing balance rows carry no movement.
+                previous_balance = balance
+                continue
+
+            amount = values[0]
+            description = match.group("description").strip(" -")
+            if tokens[0] == "-":
+                credit = True
+            elif len(tokens) > 2 and tokens[1] == "-":
+                credit = False
+            elif previous_balance is not None and balance != previous_balance:
+                credit = balance > previous_balance
+            else:
+                credit = any(keyword in description.lower() for keyword in CREDIT_KEYWORDS)
+            previous_balance = balance
+            signed = amount if credit else -amount
+
+            month, day, year = match.group("date").split("/")
+            date = f"{year}-{month}-{day}"
+            key = f"{date}|{description.lower()}|{signed:.2f}"
+            occurrences[key] += 1
+            fingerprint = hashlib.sha1(f"{key}|{occurrences[key]}".encode("utf-8")).hexdigest()
+
+            rows.append(Transaction(
+                date=date,
+                description=description,
+                amount=signed,
+                balance=balance,
+                category=categorize(description, signed),
+                fingerprint=fingerprint,
+                span=match.span(),
+            ))
+        pages.append(rows)
+    return pages
+
+
+def strip_rows(text, rows):
+    """Remove the given rows from a page, keeping headers and all other rows."""
+    normalized = normalize_text(text)
+    kept, cursor = [], 0
+    for row in sorted(rows, key=lambda r: r.span):
+        start, end = row.span
+        kept.append(normalized[cursor:start])
+        cursor = end
+    kept.append(normalized[cursor:])
+    return normalize_text(" ".join(kept))
+
+
+def row_key(row):
+    """Identity of a row across exports, independent of the sign inferred from its neighbours."""
+    return (row.date, row.description.lower(), round(abs(row.amount), 2))
+
+
+def keep_rows(text, rows):
+    """
+    Remove every row from `text` that is not one of `rows`, e.g. to limit a
+    chunk linked from another export to a single statement's transactions.
+    Returns `text` unchanged when there is nothing to remove.
+    """
+    own = {row_key(row) for row in rows}
+    foreign = [row for row in parse_pages([text])[0] if row_key(row) not in own]
+    return strip_rows(text, foreign) if foreign else text
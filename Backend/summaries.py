@@ -0,0 +1,157 @@
+"""
+Hierarchical statement summaries, built at ingest.
+
+Up to three levels are stored: one summary per month (from the parsed
+transactions plus exact totals computed locally) and one per statement (from
+the month summaries). Pages are only summarized for statements whose rows
+could not be parsed, and then stand in for the months. Each summary is keyed by a hash of its inputs, so a
+re-upload or an overlapping statement only rebuilds the parts whose content
+changed. Summarization questions are then answered with a single LLM call
+over the statement and month summaries instead of a tree_summarize pass over
+every node.
+"""
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import pymongo
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.query_engine import CustomQueryEngine
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.settings import Settings
+
+from prompts import SUMMARY_ANSWER_BODY, SUMMARY_SYSTEM_PROMPT
+from rollups import month_label
+
+def _key(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def _month_digest(month, rows):
+    """Exact, locally computed figures for a month, handed to the LLM verbatim."""
+    income = sum(row.amount for row in rows if row.amount > 0)
+    expenditure = -sum(row.amount for row in rows if row.amount < 0)
+    categories = defaultdict(float)
+    for row in rows:
+        if row.amount < 0:
+            categories[row.category] += -row.amount
+    lines = [
+        f"Month: {month_label(month)}",
+        f"Total income: {income:.2f}",
+        f"Total expenditure: {expenditure:.2f}",
+        f"Net savings: {income - expenditure:.2f}",
+        "Spending by category: " + ", ".join(
+            f"{name} {amount:.2f}" for name, amount in sorted(categories.items(), key=lambda item: -item[1])
+        ),
+        "Transactions (date, description, amount, balance):",
+    ]
+    lines.extend(f"{row.date}, {row.description}, {row.amount:.2f}, {row.balance:.2f}" for row in rows)
+    return "\n".join(lines)
+
+
+class StatementSummaryStore:
+    """Content-addressed page, month and statement summaries."""
+    def __init__(self, database, call=None):
+        self.collection = database["statement_summaries"]
+        self.collection.create_index("key", unique=True)
+        self.collection.create_index([("user_id", pymongo.ASCENDING), ("account_id", pymongo.ASCENDING)])
+        self.call = call or (lambda fn, *args, **kwargs: fn(*args, **kwargs))
+
+    def build(self, user_id, account_id, pages, transactions):
+        """
+        Ensure summaries exist for one statement and return their keys:
+        {"statement": key, "months": [key, ...], "pages": [key, ...]}.
+        `pages` is [(page_hash, text), ...]; `transactions` the parsed rows.
+        "pages" is empty unless no transactions were parsed.
+        """
+        scope = (user_id, account_id)
+        pending = {}
+
+        by_month = defaultdict(list)
+        for row in transactions:
+            by_month[row.month].append(row)
+        month_keys = []
+        for month in sorted(by_month):
+            rows = by_month[month]
+            key = _key("month", *scope, month, *(row.fingerprint for row in rows))
+            month_keys.append(key)
+            pending.setdefault(key, ("month", month, f"Summarize this month of the statement:\n{_month_digest(month, rows)}"))
+
+        page_keys = []
+        if not month_keys:
+            for page_hash, text in pages:
+                key = _key("page", *scope, page_hash)
+                page_keys.append(key)
+                pending.setdefault(key, ("page", "Page", f"Summarize this statement page:\n{text}"))
+
+        self._generate(user_id, account_id, pending)
+
+        # The statement level depends only on its children, so it is rebuilt
+        # exactly when one of them changed.
+        children = month_keys or page_keys
+        statement_key = _key("statement", *scope, *children)
+        if not self.collection.count_documents({"key": statement_key}, limit=1):
+            texts = self.texts(children)
+            body = "\n\n".join(texts[key] for key in children if key in texts)
+            self._generate(user_id, account_id, {
+                statement_key: ("statement", "Statement", f"Write an overall summary of the statement from these parts:\n{body}")
+            })
+        return {"statement": statement_key, "months": month_keys, "pages": list(dict.fromkeys(page_keys))}
+
+    def texts(self, keys):
+        return {
+            doc["key"]: doc["text"]
+            for doc in self.collection.find({"key": {"$in": list(keys)}}, {"_id": 0, "key": 1, "text": 1})
+        }
+
+    def render(self, summary_keys):
+        """The statement summary followed by each month's, as one context block."""
+        if not summary_keys:
+            return ""
+        ordered = [summary_keys["statement"]] + (summary_keys["months"] or summary_keys["pages"])
+        found = {
+            doc["key"]: doc
+            for doc in self.collection.find({"key": {"$in": ordered}}, {"_id": 0, "key": 1, "level": 1, "label": 1, "text": 1})
+        }
+        sections = []
+        for key in ordered:
+            if key in found:
+                label = found[key]["label"]
+                heading = month_label(label) if found[key].get("level") == "month" else label
+                sections.append(f"{heading}:\n{found[key]['text']}")
+        return "\n\n".join(sections)
+
+    def _generate(self, user_id, account_id, pending):
+        existing = {doc["key"] for doc in self.collection.find({"key": {"$in": list(pending)}}, {"key": 1})}
+        missing = [(key, spec) for key, spec in pending.items() if key not in existing]
+        if not missing:
+            return
+
+        # One LLM call at a time: this runs as a single scheduler job, so fanning
+        # out here would take more of the LLM than the scheduler admitted. Each
+        # summary is stored as soon as it exists so a failure keeps the rest.
+        for key, (level, label, prompt) in missing:
+            response = self.call(Settings.llm.chat, [
+                ChatMessage(role=MessageRole.SYSTEM, content=SUMMARY_SYSTEM_PROMPT),
+                ChatMessage(role=MessageRole.USER, content=prompt),
+            ])
+            doc = {"key": key, "level": level, "label": label, "user_id": user_id, "account_id": account_id,
+                   "text": response.message.content.strip(), "created_at": datetime.now(timezone.utc)}
+            self.collection.update_one({"key": key}, {"$setOnInsert": doc}, upsert=True)
+
+
+class StoredSummaryQueryEngine(CustomQueryEngine):
+    """Answers summarization questions with one LLM call over stored summaries."""
+    summaries: str
+    system_prompt: str
+
+    def custom_query(self, query_str):
+        response = Settings.llm.chat([
+            ChatMessage(role=MessageRole.SYSTEM, content=self.system_prompt),
+            ChatMessage(role=MessageRole.USER, content=SUMMARY_ANSWER_BODY.format(summaries=self.summaries, query=query_str)),
+        ])
+        return Response(
+            response=response.message.content,
+            source_nodes=[NodeWithScore(node=TextNode(text=self.summaries), score=1.0)],
+        )
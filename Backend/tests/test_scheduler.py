@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerOverloaded
+
+TIMEOUT = 5
+
+
+def blocker(scheduler, user_id="blocker", priority=BATCH):
+    """Occupy a worker until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(TIMEOUT)
+
+    future = scheduler.submit(user_id, priority, hold)
+    assert started.wait(TIMEOUT)
+    return release, future
+
+
+def test_interactive_jobs_are_dispatched_before_batch_jobs():
+    scheduler = LLMScheduler(workers=1, reserved_interactive=0, per_user_limit=4)
+    release, _ = blocker(scheduler)
+    order = []
+
+    futures = [
+        scheduler.submit("a", BATCH, order.append, "batch"),
+        scheduler.submit("b", INTERACTIVE, order.append, "interactive"),
+    ]
+    release.set()
+    for future in futures:
+        future.result(TIMEOUT)
+
+    assert order == ["interactive", "batch"]
+
+
+def test_reserved_workers_stay_free_for_interactive_jobs():
+    scheduler = LLMScheduler(workers=2, reserved_interactive=1, per_user_limit=4)
+    release, _ = blocker(scheduler, "a")
+
+    queued = scheduler.submit("b", BATCH, lambda: "batch")
+    assert scheduler.run("c", INTERACTIVE, lambda: "chat") == "chat"
+    assert not queued.done()
+
+    release.set()
+    assert queued.result(TIMEOUT) == "batch"
+
+
+def test_a_users_batch_job_does_not_block_their_interactive_job():
+    scheduler = LLMScheduler(workers=4, reserved_interactive=1, per_user_limit=1)
+    release, upload = blocker(scheduler, "alice", BATCH)
+
+    assert scheduler.submit("alice", INTERACTIVE, lambda: "chat").result(TIMEOUT) == "chat"
+    assert not upload.done()
+    release.set()
+
+
+def test_per_user_quota_holds_back_only_that_user():
+    scheduler = LLMScheduler(workers=4, reserved_interactive=0, per_user_limit=1)
+    release, _ = blocker(scheduler, "alice", BATCH)
+
+    second = scheduler.submit("alice", BATCH, lambda: "alice")
+    assert scheduler.submit("bob", BATCH, lambda: "bob").result(TIMEOUT) == "bob"
+    assert not second.done()
+
+    release.set()
+    assert second.result(TIMEOUT) == "alice"
+
+
+def test_limits_override_the_quota_for_a_tenant():
+    scheduler = LLMScheduler(workers=4, reserved_interactive=0, per_user_limit=1, limits={"precompute": 2})
+    release, _ = blocker(scheduler, "precompute")
+
+    assert scheduler.submit("precompute", BATCH, lambda: "second").result(TIMEOUT) == "second"
+    release.set()
+
+
+def test_fair_queuing_interleaves_a_backlog_with_other_tenants():
+    scheduler = LLMScheduler(workers=1, reserved_interactive=0, per_user_limit=4)
+    release, _ = blocker(scheduler)
+    order = []
+
+    futures = [scheduler.submit("a", BATCH, order.append, f"a{i}") for i in range(3)]
+    futures.append(scheduler.submit("b", BATCH, order.append, "b0"))
+    release.set()
+    for future in futures:
+        future.result(TIMEOUT)
+
+    assert order == ["a0", "b0", "a1", "a2"]
+
+
+def test_interactive_jobs_that_wait_too_long_fail_fast():
+    scheduler = LLMScheduler(workers=1, reserved_interactive=0, max_wait={INTERACTIVE: 0.05, BATCH: None})
+    release, _ = blocker(scheduler, priority=INTERACTIVE)
+    ran = threading.Event()
+
+    expired = scheduler.submit("a", INTERACTIVE, ran.set)
+    with pytest.raises(SchedulerOverloaded):
+        expired.result(TIMEOUT)
+
+    release.set()
+    assert not ran.is_set()
+
+
+def test_batch_jobs_wait_instead_of_expiring():
+    scheduler = LLMScheduler(workers=1, reserved_interactive=0, max_wait={INTERACTIVE: 0.05, BATCH: None})
+    release, _ = blocker(scheduler)
+
+    queued = scheduler.submit("a", BATCH, lambda: "done")
+    threading.Timer(1.5, release.set).start()
+
+    assert queued.result(TIMEOUT) == "done"
+
+
+def test_job_errors_reach_the_caller_and_free_the_worker():
+    scheduler = LLMScheduler(workers=1, reserved_interactive=0, per_user_limit=1)
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        scheduler.run("a", BATCH, fail)
+    assert scheduler.run("a", BATCH, lambda: "next") == "next"
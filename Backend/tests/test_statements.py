@@ -0,0 +1,130 @@
+import os
+
+import pytest
+from pypdf import PdfReader
+
+from statements import detect_account, keep_rows, page_fingerprint, parse_pages, strip_rows
+
+DOWNLOADS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "downloads")
+
+
+def read_pages(filename):
+    """Page texts as the upload path sees them (SimpleDirectoryReader reads PDFs with pypdf)."""
+    return [page.extract_text() for page in PdfReader(os.path.join(DOWNLOADS, filename)).pages]
+
+
+@pytest.fixture(scope="module")
+def six_months():
+    return read_pages("6_Months_Bank_Statement.pdf")
+
+
+@pytest.fixture(scope="module")
+def last_three_months():
+    return read_pages("Last 3 Months Bank Statement.pdf")
+
+
+@pytest.mark.parametrize("filename, account, rows_per_page, months", [
+    ("6_Months_Bank_Statement.pdf", "456-789-123", [5, 5, 7, 7, 4],
+     ["2023-02", "2023-03", "2023-04", "2023-05", "2023-06"]),
+    ("Last 3 Months Bank Statement.pdf", "456-789-123", [5, 5, 3], ["2023-04", "2023-05", "2023-06"]),
+    ("Sample Bank Statement.pdf", "987-654-321", [10, 10, 10],
+     ["2023-01", "2023-02", "2023-03", "2023-04", "2023-05", "2023-06"]),
+])
+def test_parse_pages_reads_every_row(filename, account, rows_per_page, months):
+    texts = read_pages(filename)
+    pages = parse_pages(texts)
+
+    assert detect_account(texts[0]) == account
+    assert [len(rows) for rows in pages] == rows_per_page
+    rows = [row for page in pages for row in page]
+    assert sorted({row.month for row in rows}) == months
+    assert len({row.fingerprint for row in rows}) == len(rows)
+
+
+def test_parse_pages_signs_and_categories(six_months):
+    first = parse_pages(six_months)[0][:4]
+
+    assert [(row.date, row.description, row.amount, row.balance, row.category) for row in first] == [
+        ("2023-02-05", "Salary Deposit", 2500.0, 6500.0, "Income"),
+        ("2023-02-10", "Grocery Store", -250.0, 6250.0, "Groceries"),
+        ("2023-02-15", "Electricity Bill", -120.0, 6130.0, "Utilities"),
+        ("2023-02-20", "Rent Payment", -1500.0, 4630.0, "Rent"),
+    ]
+
+
+@pytest.mark.parametrize("filename", ["6_Months_Bank_Statement.pdf", "Last 3 Months Bank Statement.pdf"])
+def test_parsed_amounts_follow_the_running_balance(filename):
+    rows = [row for page in parse_pages(read_pages(filename)) for row in page]
+
+    for previous, row in zip(rows, rows[1:]):
+        assert previous.balance + row.amount == pytest.approx(row.balance)
+
+
+def test_overlapping_exports_fingerprint_shared_rows_alike(six_months, last_three_months):
+    six = {row.fingerprint: row for page in parse_pages(six_months) for row in page}
+    three = {row.fingerprint: row for page in parse_pages(last_three_months) for row in page}
+
+    assert parse_pages(six_months) == parse_pages(six_months)
+    shared = set(six) & set(three)
+    assert shared
+    assert all(six[fingerprint].date == three[fingerprint].date for fingerprint in shared)
+
+
+def test_repeated_rows_get_distinct_fingerprints():
+    text = "01/05/2023 Coffee Shop $5.00 - $95.00 01/05/2023 Coffee Shop $5.00 - $90.00"
+
+    first, second = parse_pages([text])[0]
+
+    assert (first.date, first.description, first.amount) == (second.date, second.description, second.amount)
+    assert first.fingerprint != second.fingerprint
+
+
+def test_page_fingerprint_ignores_whitespace_and_case(six_months):
+    page = six_months[0]
+
+    assert page_fingerprint(page) == page_fingerprint("  " + page.upper().replace(" ", "\n"))
+    assert page_fingerprint(page) != page_fingerprint(six_months[1])
+
+
+def test_strip_rows_keeps_headers_and_other_rows(six_months):
+    page = six_months[0]
+    rows = parse_pages([page])[0]
+
+    stripped = strip_rows(page, rows[:2])
+
+    assert "Account Number: 456-789-123" in stripped
+    assert "Salary Deposit" not in stripped and "Grocery Store" not in stripped
+    assert [row.description for row in parse_pages([stripped])[0]] == [row.description for row in rows[2:]]
+
+
+def test_strip_rows_without_rows_only_normalizes(six_months):
+    assert strip_rows(six_months[0], []) == " ".join(six_months[0].split())
+
+
+def test_keep_rows_limits_a_page_to_the_given_rows(six_months):
+    page = six_months[0]
+    rows = parse_pages([page])[0]
+    own = [row for row in rows if row.category in ("Income", "Rent")]
+
+    kept = keep_rows(page, own)
+
+    assert sorted(row.description for row in parse_pages([kept])[0]) == sorted(row.description for row in own)
+    assert "Account Number: 456-789-123" in kept
+
+
+def test_keep_rows_matches_rows_parsed_from_another_export(six_months, last_three_months):
+    # A chunk linked from the six-month export, restricted to the three-month statement's rows.
+    own = [row for page in parse_pages(last_three_months) for row in page]
+    page = next(text for text, rows in zip(six_months, parse_pages(six_months)) if any(r.month == "2023-03" for r in rows)
+                and any(r.month == "2023-04" for r in rows))
+
+    kept = parse_pages([keep_rows(page, own)])[0]
+
+    assert kept
+    assert all(row.month >= "2023-04" for row in kept)
+
+
+def test_keep_rows_returns_text_unchanged_when_nothing_is_foreign(six_months):
+    page = six_months[0]
+
+    assert keep_rows(page, parse_pages([page])[0]) is page
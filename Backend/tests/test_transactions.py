@@ -0,0 +1,158 @@
+import hashlib
+
+import pytest
+
+pytest.importorskip("pydantic")
+pytest.importorskip("llama_index.core")
+
+from statements import Transaction, categorize  # noqa: E402
+from transactions import TransactionFilters, TransactionStore, clean_filters, decode_cursor  # noqa: E402
+
+ACCOUNT = "456-789-123"
+
+
+def txn(date, description, amount, balance=0.0):
+    return Transaction(
+        date=date,
+        description=description,
+        amount=amount,
+        balance=balance,
+        category=categorize(description, amount),
+        fingerprint=hashlib.sha1(f"{date}|{description}|{amount}".encode("utf-8")).hexdigest(),
+        span=(0, 0),
+    )
+
+
+ROWS = [
+    txn("2023-01-05", "Salary Deposit", 2800.0),
+    txn("2023-01-12", "Grocery Store", -220.0),
+    txn("2023-01-20", "Coffee Shop", -4.5),
+    txn("2023-02-05", "Salary Deposit", 2800.0),
+    txn("2023-02-10", "Rent Payment", -1250.0),
+    txn("2023-02-14", "Coffee Shop", -6.0),
+    txn("2023-03-03", "Grocery Store", -180.0),
+    txn("2023-03-28", "Online Shopping", -75.25),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TransactionStore(str(tmp_path))
+    store.append("1", ACCOUNT, ROWS)
+    return store
+
+
+def descriptions(page):
+    return [row["description"] for row in page["transactions"]]
+
+
+def test_append_partitions_by_month(store):
+    assert store.months("1") == ["2023-01", "2023-02", "2023-03"]
+    assert store.months("2") == []
+
+
+def test_reappending_a_statement_adds_nothing(store):
+    store.append("1", ACCOUNT, ROWS[:4])
+
+    assert store.query("1", limit=100)["total"] == len(ROWS)
+
+
+def test_same_rows_on_another_account_are_kept(store):
+    store.append("1", "000-111-222", ROWS[:1])
+
+    assert store.query("1", limit=100)["total"] == len(ROWS) + 1
+    assert store.query("1", account_id="000-111-222")["total"] == 1
+
+
+def test_default_sort_is_newest_first(store):
+    page = store.query("1")
+
+    assert [row["date"] for row in page["transactions"]] == sorted((row.date for row in ROWS), reverse=True)
+
+
+def test_date_range_is_inclusive(store):
+    page = store.query("1", start="2023-01-12", end="2023-02-05", sort="date")
+
+    assert descriptions(page) == ["Grocery Store", "Coffee Shop", "Salary Deposit"]
+
+
+@pytest.mark.parametrize("filters, expected", [
+    ({"merchant": "coffee"}, {"Coffee Shop"}),
+    ({"category": "groceries"}, {"Grocery Store"}),
+    ({"kind": "credit"}, {"Salary Deposit"}),
+    ({"kind": "debit", "min_amount": 200}, {"Grocery Store", "Rent Payment"}),
+    ({"min_amount": 75.25, "max_amount": 180}, {"Grocery Store", "Online Shopping"}),
+])
+def test_filters(store, filters, expected):
+    assert set(descriptions(store.query("1", limit=100, **filters))) == expected
+
+
+def test_amount_sort_uses_absolute_amount(store):
+    page = store.query("1", sort="-amount", limit=3)
+
+    assert [row["amount"] for row in page["transactions"]] == [2800.0, 2800.0, -1250.0]
+
+
+def test_total_and_net_amount_cover_every_page(store):
+    page = store.query("1", kind="debit", limit=2)
+
+    assert len(page["transactions"]) == 2
+    assert page["total"] == 6
+    assert page["net_amount"] == round(sum(row.amount for row in ROWS if row.amount < 0), 2)
+
+
+@pytest.mark.parametrize("sort", ["date", "-date", "amount", "-amount"])
+def test_cursor_pagination_visits_every_row_once(store, sort):
+    seen, cursor = [], None
+    while True:
+        page = store.query("1", sort=sort, limit=3, cursor=cursor)
+        seen.extend(row["id"] for row in page["transactions"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(row.fingerprint for row in ROWS)
+    assert seen == [row["id"] for row in store.query("1", sort=sort, limit=100)["transactions"]]
+
+
+def test_cursor_survives_appends_between_pages(store):
+    first = store.query("1", sort="date", limit=4)
+    store.append("1", ACCOUNT, [txn("2023-01-01", "Opening Fee", -1.0)])
+
+    second = store.query("1", sort="date", limit=100, cursor=first["next_cursor"])
+
+    assert descriptions(first) + descriptions(second) == [row.description for row in ROWS]
+
+
+def test_invalid_cursor_and_sort_are_rejected(store):
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+    with pytest.raises(ValueError):
+        store.query("1", sort="balance")
+
+
+def test_long_descriptions_and_account_ids_are_not_truncated(tmp_path):
+    store = TransactionStore(str(tmp_path))
+    account_id = "GB29-NWBK-6016-1331-9268-19-0000-0000-0001"
+    description = "Card payment to " + "Very Long Merchant Name Ltd " * 4 + "Coffee"
+    store.append("1", account_id, [txn("2023-01-05", "Short", -1.0)])
+    store.append("1", f" {account_id} ", [txn("2023-01-06", description, -2.0)])
+
+    page = store.query("1", account_id=account_id, merchant="coffee")
+
+    assert descriptions(page) == [description]
+    assert page["transactions"][0]["account_id"] == account_id
+    assert store.query("1", account_id=account_id)["total"] == 2
+
+
+def test_clean_filters_drops_values_in_the_wrong_form():
+    filters = TransactionFilters(start="March 2023", end="2023-03-31", min_amount=float("inf"),
+                                 kind="outgoing", sort="biggest")
+
+    options = clean_filters(filters)
+
+    assert options["start"] is None
+    assert options["end"] == "2023-03-31"
+    assert options["min_amount"] is None
+    assert options["kind"] is None
+    assert options["sort"] == "-date"
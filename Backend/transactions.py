@@ -0,0 +1,371 @@
+"""
+Columnar on-disk transaction store.
+
+Parsed transactions are kept as one memory-mapped NumPy array per column,
+partitioned by user and month:
+
+    <root>/user=<id>/month=YYYY-MM/<version>/{date,amount,...}.npy
+    <root>/user=<id>/month=YYYY-MM/CURRENT      -> name of the live version
+
+Queries prune partitions by month from the directory names, evaluate the
+predicates on the mapped columns of what is left, sort only the matching
+rows, and page through them with a keyset cursor. Writes build a new
+partition version and swap CURRENT atomically, so readers never see a
+half-written partition. A query resolves each partition's version once and
+maps all its columns together; superseded versions are only deleted after
+VERSION_GRACE_SECONDS, so a reader that resolved one just before a swap can
+still open it.
+"""
+import base64
+import html
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.query_engine import CustomQueryEngine
+from llama_index.core.schema import NodeWithScore, TextNode
+from llama_index.core.settings import Settings
+
+# String columns are sized from the data they hold (`str` lets NumPy pick the
+# width) so long descriptions and account ids are never truncated; merging a
+# partition widens the column to its longest value.
+COLUMNS = {
+    "date": "datetime64[D]",
+    "amount": "float64",
+    "balance": "float64",
+    "description": str,
+    "merchant_key": str,
+    "category": str,
+    "account_id": str,
+    "fingerprint": str,
+}
+SORT_FIELDS = ("date", "-date", "amount", "-amount")
+MAX_PAGE_SIZE = 500
+VERSION_GRACE_SECONDS = 300
+
+
+def _safe(value):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(value))
+
+
+def encode_cursor(key, fingerprint):
+    return base64.urlsafe_b64encode(json.dumps([key, fingerprint]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        key, fingerprint = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(key), str(fingerprint)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+class TransactionStore:
+    """Per-user, per-month columnar partitions of parsed transactions."""
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._locks = defaultdict(threading.Lock)
+
+    # ------------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------------
+
+    def append(self, user_id, account_id, transactions):
+        """
+        Add parsed transactions to their month partitions. Rows already
+        stored for the account are skipped, so re-appending a statement is safe.
+        """
+        by_month = defaultdict(list)
+        for txn in transactions:
+            by_month[txn.month].append(txn)
+        for month, rows in by_month.items():
+            new = {
+                "date": np.array([row.date for row in rows], dtype=COLUMNS["date"]),
+                "amount": np.array([row.amount for row in rows], dtype=COLUMNS["amount"]),
+                "balance": np.array([row.balance for row in rows], dtype=COLUMNS["balance"]),
+                "description": np.array([row.description for row in rows], dtype=COLUMNS["description"]),
+                "merchant_key": np.array([row.description.lower() for row in rows], dtype=COLUMNS["merchant_key"]),
+                "category": np.array([row.category for row in rows], dtype=COLUMNS["category"]),
+                "account_id": np.array([str(account_id).strip()] * len(rows), dtype=COLUMNS["account_id"]),
+                "fingerprint": np.array([row.fingerprint for row in rows], dtype=COLUMNS["fingerprint"]),
+            }
+            self._merge_partition(self._partition_path(user_id, month), new)
+        return len(by_month)
+
+    def _merge_partition(self, path, new):
+        with self._locks[path]:
+            existing = self._load_partition(path, COLUMNS)
+            if existing is not None:
+                known = set(zip(existing["account_id"].tolist(), existing["fingerprint"].tolist()))
+                keep = np.array(
+                    [row not in known for row in zip(new["account_id"].tolist(), new["fingerprint"].tolist())],
+                    dtype=bool,
+                )
+                if not keep.any():
+                    return
+                merged = {name: np.concatenate([existing[name], new[name][keep]]) for name in COLUMNS}
+            else:
+                merged = new
+            order = np.lexsort((merged["fingerprint"], merged["date"]))
+
+            version = uuid.uuid4().hex
+            os.makedirs(os.path.join(path, version))
+            for name in COLUMNS:
+                np.save(os.path.join(path, version, f"{name}.npy"), merged[name][order])
+            pointer = os.path.join(path, f"CURRENT.{version}")
+            with open(pointer, "w") as f:
+                f.write(version)
+            os.replace(pointer, os.path.join(path, "CURRENT"))
+            self._collect_garbage(path, version)
+
+    def _collect_garbage(self, path, current):
+        """Delete superseded versions once no reader can still be about to open them."""
+        cutoff = time.time() - VERSION_GRACE_SECONDS
+        for name in os.listdir(path):
+            version_dir = os.path.join(path, name)
+            if name != current and os.path.isdir(version_dir) and os.path.getmtime(version_dir) < cutoff:
+                shutil.rmtree(version_dir, ignore_errors=True)
+
+    # ------------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------------
+
+    def months(self, user_id):
+        user_dir = os.path.join(self.root, f"user={_safe(user_id)}")
+        if not os.path.isdir(user_dir):
+            return []
+        return sorted(name[len("month="):] for name in os.listdir(user_dir) if name.startswith("month="))
+
+    def query(
+        self,
+        user_id,
+        start=None,
+        end=None,
+        min_amount=None,
+        max_amount=None,
+        merchant=None,
+        category=None,
+        kind=None,
+        account_id=None,
+        sort="-date",
+        limit=50,
+        cursor=None,
+    ):
+        """
+        Filter a user's transactions and return one page:
+        {"transactions": [...], "next_cursor": str or None,
+         "total": matches across all pages, "net_amount": their signed sum}.
+
+        `start`/`end` are inclusive ISO dates. Amount bounds and amount
+        sorting use the absolute amount. `kind` is "debit" or "credit".
+        `merchant` is a case-insensitive substring of the description.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"sort must be one of {list(SORT_FIELDS)}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        start_day = np.datetime64(start, "D") if start else None
+        end_day = np.datetime64(end, "D") if end else None
+
+        # Partition pruning on the month directory names.
+        months = [
+            month for month in self.months(user_id)
+            if (not start or month >= start[:7]) and (not end or month <= end[:7])
+        ]
+
+        matches = []
+        for month in months:
+            # Every column is mapped from the same version up front; pages are
+            # only read for the columns the predicates and the page touch.
+            columns = self._load_partition(self._partition_path(user_id, month), COLUMNS, mmap=True)
+            if columns is None:
+                continue
+            mask = np.ones(len(columns["date"]), dtype=bool)
+            if start_day is not None:
+                mask &= columns["date"] >= start_day
+            if end_day is not None:
+                mask &= columns["date"] <= end_day
+            absolute = np.abs(columns["amount"])
+            if min_amount is not None:
+                mask &= absolute >= float(min_amount)
+            if max_amount is not None:
+                mask &= absolute <= float(max_amount)
+            if kind == "debit":
+                mask &= columns["amount"] < 0
+            elif kind == "credit":
+                mask &= columns["amount"] > 0
+            if merchant:
+                mask &= np.char.find(columns["merchant_key"], merchant.lower()) >= 0
+            if category:
+                mask &= np.char.lower(columns["category"]) == category.lower()
+            if account_id is not None:
+                mask &= columns["account_id"] == str(account_id).strip()
+            rows = np.nonzero(mask)[0]
+            if len(rows):
+                key = columns["date"][rows].astype("float64") if sort.lstrip("-") == "date" else absolute[rows]
+                matches.append((columns, rows, key, columns["fingerprint"][rows], columns["amount"][rows]))
+
+        if not matches:
+            return {"transactions": [], "next_cursor": None, "total": 0, "net_amount": 0.0}
+
+        amounts = np.concatenate([m[4] for m in matches])
+        keys = np.concatenate([m[2] for m in matches])
+        fingerprints = np.concatenate([m[3] for m in matches])
+        origin = np.concatenate([np.full(len(m[1]), i) for i, m in enumerate(matches)])
+        row_index = np.concatenate([m[1] for m in matches])
+
+        descending = sort.startswith("-")
+        order = np.lexsort((fingerprints, keys))
+        if descending:
+            order = order[::-1]
+        if cursor:
+            cursor_key, cursor_fp = decode_cursor(cursor)
+            ordered_keys, ordered_fps = keys[order], fingerprints[order]
+            if descending:
+                after = (ordered_keys < cursor_key) | ((ordered_keys == cursor_key) & (ordered_fps < cursor_fp))
+            else:
+                after = (ordered_keys > cursor_key) | ((ordered_keys == cursor_key) & (ordered_fps > cursor_fp))
+            order = order[after]
+
+        page = order[:limit]
+        next_cursor = None
+        if len(order) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor(float(keys[last]), str(fingerprints[last]))
+        return {
+            "transactions": self._materialize(matches, origin[page], row_index[page]),
+            "next_cursor": next_cursor,
+            "total": int(len(keys)),
+            "net_amount": round(float(amounts.sum()), 2),
+        }
+
+    def _materialize(self, matches, origins, rows):
+        """Read full rows for the page only, keeping page order."""
+        result = [None] * len(rows)
+        for origin in np.unique(origins):
+            positions = np.nonzero(origins == origin)[0]
+            columns = matches[origin][0]
+            for position in positions:
+                row = rows[position]
+                result[position] = {
+                    "date": str(columns["date"][row]),
+                    "description": str(columns["description"][row]),
+                    "amount": float(columns["amount"][row]),
+                    "balance": float(columns["balance"][row]),
+                    "category": str(columns["category"][row]),
+                    "account_id": str(columns["account_id"][row]),
+                    "id": str(columns["fingerprint"][row]),
+                }
+        return result
+
+    def _partition_path(self, user_id, month):
+        return os.path.join(self.root, f"user={_safe(user_id)}", f"month={month}")
+
+    def _current_version(self, path):
+        try:
+            with open(os.path.join(path, "CURRENT")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _load_partition(self, path, names, mmap=False):
+        version = self._current_version(path)
+        if not version:
+            return None
+        mode = "r" if mmap else None
+        return {name: np.load(os.path.join(path, version, f"{name}.npy"), mmap_mode=mode) for name in names}
+
+
+# ============================================================================
+# Chat tool
+# ============================================================================
+
+class TransactionFilters(BaseModel):
+    """Filters for looking up specific transactions in a bank statement."""
+    start: Optional[str] = Field(None, description="Inclusive start date, YYYY-MM-DD")
+    end: Optional[str] = Field(None, description="Inclusive end date, YYYY-MM-DD")
+    min_amount: Optional[float] = Field(None, description="Minimum absolute amount")
+    max_amount: Optional[float] = Field(None, description="Maximum absolute amount")
+    merchant: Optional[str] = Field(None, description="Text that appears in the transaction description")
+    category: Optional[str] = Field(None, description="Spending category, e.g. Rent, Groceries, Dining, Shopping")
+    kind: Optional[str] = Field(None, description="'debit' for charges/payments, 'credit' for deposits/income")
+    sort: str = Field("-date", description="One of date, -date, amount, -amount (-amount = largest first)")
+
+
+FILTER_PROMPT = PromptTemplate(
+    "Turn the question into transaction filters. The user's data covers these months: {months}.\n"
+    "Leave a filter empty unless the question asks for it. If a month is named without a year, "
+    "use the year from the data.\n"
+    "Question: {question}"
+)
+
+
+def clean_filters(filters):
+    """Filter values as the store expects them; values the LLM produced in another form are dropped."""
+    options = filters.model_dump()
+    for name in ("start", "end"):
+        try:
+            options[name] = datetime.strptime(options[name], "%Y-%m-%d").date().isoformat()
+        except (TypeError, ValueError):
+            options[name] = None
+    for name in ("min_amount", "max_amount"):
+        if options[name] is not None and not np.isfinite(options[name]):
+            options[name] = None
+    if options["kind"] not in ("debit", "credit"):
+        options["kind"] = None
+    if options["sort"] not in SORT_FIELDS:
+        options["sort"] = "-date"
+    return options
+
+
+class TransactionQueryEngine(CustomQueryEngine):
+    """Answers questions about specific transactions straight from the columnar store."""
+    store: TransactionStore
+    user_id: str
+    account_id: Optional[str] = None
+    question: str = ""
+    limit: int = 100
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def custom_query(self, query_str):
+        filters = Settings.llm.structured_predict(
+            TransactionFilters,
+            FILTER_PROMPT,
+            months=", ".join(self.store.months(self.user_id)) or "unknown",
+            question=self.question or query_str,
+        )
+        page = self.store.query(self.user_id, account_id=self.account_id, limit=self.limit, **clean_filters(filters))
+        table = _render(page)
+        return Response(response=table, source_nodes=[NodeWithScore(node=TextNode(text=table), score=1.0)])
+
+
+def _render(page):
+    """HTML table for one page; the heading reports count and net over every match."""
+    transactions = page["transactions"]
+    if not transactions:
+        return "<div><p>No transactions in the statement match that request.</p></div>"
+    rows = "".join(
+        f"<tr><td>{txn['date']}</td><td>{html.escape(txn['description'])}</td>"
+        f"<td>{html.escape(txn['category'])}</td><td>{txn['amount']:,.2f}</td></tr>"
+        for txn in transactions
+    )
+    note = f"<p>Showing the first {len(transactions)} of {page['total']}.</p>" if page["total"] > len(transactions) else ""
+    return (
+        f"<div><h4>{page['total']} matching transactions (net {page['net_amount']:,.2f})</h4>"
+        "<table><tr><th>Date</th><th>Description</th><th>Category</th><th>Amount</th></tr>"
+        f"{rows}</table>{note}</div>"
+    )